@@ -0,0 +1,147 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from matplotlib.figure import Figure
+
+# dpi and a scale applied to each chart's base figure size
+CHART_PROFILES = {
+    "web": {"dpi": 96, "scale": 0.8},
+    "print": {"dpi": 300, "scale": 1.0},
+}
+CHART_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+CHART_TITLES = {
+    "compliance_score": "Compliance Score Breakdown",
+    "risk_distribution": "Risk Rating Distribution",
+    "owner_performance": "Control Distribution by Owner",
+    "trend_analysis": "Overdue Items Trend Analysis",
+}
+
+
+def _compliance_score(fig, data):
+    ax = fig.add_subplot()
+    categories = ['Passed', 'Failed', 'Overdue', 'Missing Owner']
+    values = [100 - data["failed_pct"] - data["overdue_pct"] - data["missing_owner_pct"],
+              data["failed_pct"], data["overdue_pct"], data["missing_owner_pct"]]
+
+    # Use hex colors to avoid matplotlib color issues
+    colors = ['#2E8B57', '#DC143C', '#FF8C00', '#696969']
+
+    bars = ax.bar(categories, values, color=colors, alpha=0.8)
+    ax.set_ylabel('Percentage (%)', fontsize=12)
+    ax.set_title(f'{data["mode"].upper()} Compliance Score: {data["compliance_score"]:.1f}%', fontsize=14, fontweight='bold')
+    ax.set_ylim(0, 100)
+
+    # Add value labels on bars
+    for bar, value in zip(bars, values):
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width() / 2., height + 1,
+                f'{value:.1f}%', ha='center', va='bottom', fontweight='bold')
+
+
+def _risk_distribution(fig, data):
+    ax = fig.add_subplot()
+    colors = ['#FF6B6B', '#FFE66D', '#4ECDC4']
+    ax.pie(data["values"], labels=data["labels"], autopct='%1.1f%%',
+           colors=colors[:len(data["values"])], startangle=90)
+    ax.set_title('Risk Rating Distribution', fontsize=14, fontweight='bold')
+
+
+def _owner_performance(fig, data):
+    ax = fig.add_subplot()
+    colors = ['#3498DB', '#E74C3C', '#2ECC71', '#F39C12', '#9B59B6', '#1ABC9C', '#E67E22', '#34495E']
+    values = data["values"]
+
+    bars = ax.bar(range(len(values)), values, color=colors[:len(values)], alpha=0.8)
+    ax.set_xlabel('Control Owners', fontsize=12)
+    ax.set_ylabel('Number of Controls', fontsize=12)
+    ax.set_title('Control Distribution by Owner', fontsize=14, fontweight='bold')
+    ax.set_xticks(range(len(values)))
+    ax.set_xticklabels(data["labels"], rotation=45, ha='right')
+
+    # Add value labels on bars
+    for bar, value in zip(bars, values):
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width() / 2., height + 0.1,
+                str(value), ha='center', va='bottom', fontweight='bold')
+
+
+def _trend_analysis(fig, data):
+    ax = fig.add_subplot()
+    ax.plot(data["labels"], data["values"], marker='o', color='#E74C3C', linewidth=2, markersize=6)
+    ax.set_xlabel('Month', fontsize=12)
+    ax.set_ylabel('Number of Overdue Items', fontsize=12)
+    ax.set_title('Overdue Items Trend', fontsize=14, fontweight='bold')
+    ax.grid(True, alpha=0.3)
+    if len(data["labels"]) > 12:
+        ax.tick_params(axis='x', labelrotation=45)
+
+
+# chart kind -> (draw function, base figure size in inches)
+CHART_RENDERERS = {
+    "compliance_score": (_compliance_score, (10, 6)),
+    "risk_distribution": (_risk_distribution, (10, 6)),
+    "owner_performance": (_owner_performance, (12, 6)),
+    "trend_analysis": (_trend_analysis, (12, 6)),
+}
+
+
+def render_chart(kind: str, data: dict, fmt: str = "png", profile: str = "print") -> bytes:
+    """
+    Render one chart from its aggregated data. Each call builds its own Figure
+    without touching pyplot's global state, so renders can run concurrently.
+    """
+    draw, (width, height) = CHART_RENDERERS[kind]
+    settings = CHART_PROFILES[profile]
+    fig = Figure(figsize=(width * settings["scale"], height * settings["scale"]))
+    draw(fig, data)
+    fig.tight_layout()
+    buffer = BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=settings["dpi"], bbox_inches='tight', facecolor='white')
+    return buffer.getvalue()
+
+
+def warm_up_worker():
+    """Process pool initializer: load matplotlib's Agg backend and font cache once per worker."""
+    render_chart("compliance_score", {
+        "mode": "sox", "compliance_score": 0.0, "failed_pct": 0.0, "overdue_pct": 0.0, "missing_owner_pct": 0.0,
+    }, "png", "web")
+
+
+def ping():
+    return True
+
+
+def chart_key(kind: str, data: dict, fmt: str, profile: str) -> str:
+    return hashlib.sha256(json.dumps([kind, data, fmt, profile], sort_keys=True).encode()).hexdigest()
+
+
+class ChartCache:
+    """LRU cache of rendered chart bytes keyed by chart_key, bounded by entry count and total size."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+
+    def put(self, key: str, content: bytes):
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = content
+            self._total_bytes += len(content)
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
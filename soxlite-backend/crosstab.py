@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+OTHER_LABEL = "Other"
+
+
+def _codes(s: pd.Series):
+    """Integer codes (-1 for missing) and labels in sorted order, reusing categorical codes when present."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.cat.codes.to_numpy().astype(np.int64), list(s.cat.categories)
+    codes, uniques = pd.factorize(s, sort=True)
+    return codes.astype(np.int64), list(uniques)
+
+
+def _label(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _other_label(kept):
+    """OTHER_LABEL, or a suffixed variant when a kept label already reads the same."""
+    taken = {str(label) for label in kept}
+    label, n = OTHER_LABEL, 1
+    while label in taken:
+        label = f"{OTHER_LABEL} (folded)" if n == 1 else f"{OTHER_LABEL} (folded {n})"
+        n += 1
+    return label
+
+
+def _fold(codes, labels, top_k):
+    """
+    Keep the `top_k` most frequent labels, in their original order, and map
+    every other label to a trailing fold label (see _other_label), so a real
+    "Other" value is never merged with the folded ones. Returns (codes,
+    labels, folded label count).
+    """
+    counts = np.bincount(codes, minlength=len(labels))
+    present = np.flatnonzero(counts)
+    folded = max(len(present) - top_k, 0)
+    if folded:
+        present = np.sort(present[np.argsort(-counts[present], kind="stable")[:top_k]])
+    mapping = np.full(len(labels), len(present), dtype=np.int64)
+    mapping[present] = np.arange(len(present))
+    kept = [_label(labels[i]) for i in present]
+    return mapping[codes], kept + [_other_label(kept)] if folded else kept, folded
+
+
+def crosstab(rows: pd.Series, columns: pd.Series, top_k: int = 20, max_cells: int = 2000):
+    """
+    Count rows per (rows value, columns value) pair, skipping pairs with a
+    missing value. Each axis keeps its `top_k` most frequent values and folds
+    the rest into a last label, OTHER_LABEL unless that is a kept value. Only non-zero cells are returned, as [row index,
+    column index, count] triples; past `max_cells` the largest cells are kept
+    and "truncated" is set.
+    """
+    row_codes, row_labels = _codes(rows)
+    col_codes, col_labels = _codes(columns)
+    both = (row_codes >= 0) & (col_codes >= 0)
+    row_codes, row_labels, rows_folded = _fold(row_codes[both], row_labels, top_k)
+    col_codes, col_labels, cols_folded = _fold(col_codes[both], col_labels, top_k)
+
+    n_cols = max(len(col_labels), 1)
+    cells, counts = np.unique(row_codes * n_cols + col_codes, return_counts=True)
+    truncated = len(cells) > max_cells
+    if truncated:
+        keep = np.sort(np.argsort(-counts, kind="stable")[:max_cells])
+        cells, counts = cells[keep], counts[keep]
+    return {
+        "row_field": rows.name,
+        "column_field": columns.name,
+        "rows": row_labels,
+        "columns": col_labels,
+        "cells": [[int(c // n_cols), int(c % n_cols), int(n)] for c, n in zip(cells, counts)],
+        "total": int(both.sum()),
+        "folded_rows": rows_folded,
+        "folded_columns": cols_folded,
+        "truncated": bool(truncated),
+    }
+
+
+def crosstab_nested(table):
+    """
+    {column label: {row label: count}}, the shape of DataFrame.to_dict() on an
+    unstacked crosstab. Missing pairs are 0 unless the table was truncated, in
+    which case only the kept cells are listed.
+    """
+    rows, columns = table["rows"], table["columns"]
+    if table["truncated"]:
+        nested = {column: {} for column in columns}
+    else:
+        nested = {column: {row: 0 for row in rows} for column in columns}
+    for r, c, count in table["cells"]:
+        nested[columns[c]][rows[r]] = count
+    return nested
@@ -0,0 +1,68 @@
+import re
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_PROVIDERS = ("openai", "hashing")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def _features(text: str, char_ngrams: int):
+    """
+    Word tokens plus character n-grams of each token. Compound tokens like
+    "SOX-001" are kept whole and also split, so exact IDs and their parts match.
+    """
+    features = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        features.append(token)
+        parts = re.split(r"[-_.]", token)
+        if len(parts) > 1:
+            features.extend(parts)
+        padded = f"<{token}>"
+        features.extend(padded[i:i + char_ngrams] for i in range(len(padded) - char_ngrams + 1))
+    return features
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local, CPU-only embeddings using the hashing trick. Each feature is hashed with
+    CRC32 into one of `dim` buckets with a sign taken from a second hash; counts are
+    log-scaled and rows L2-normalized so cosine and L2 distance rank alike.
+
+    Needs no fitted state or network access, so vectors stay stable across
+    processes and restarts.
+    """
+
+    def __init__(self, dim: int = 512, char_ngrams: int = 3):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+
+    def _hash(self, features):
+        keys = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+        signs = np.fromiter((zlib.adler32(f.encode()) & 1 for f in features), dtype=np.int8, count=len(features))
+        return (keys % self.dim).astype(np.intp), np.where(signs == 1, 1.0, -1.0)
+
+    def embed_documents(self, texts):
+        rows, cols = [], []
+        # Hash each distinct feature once per batch
+        vocabulary = {}
+        for row, text in enumerate(texts):
+            features = _features(text, self.char_ngrams)
+            ids = [vocabulary.setdefault(f, len(vocabulary)) for f in features]
+            rows.append(np.full(len(ids), row, dtype=np.intp))
+            cols.append(np.asarray(ids, dtype=np.intp))
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float64)
+        if vocabulary:
+            buckets, signs = self._hash(list(vocabulary))
+            row_idx = np.concatenate(rows)
+            feature_idx = np.concatenate(cols)
+            np.add.at(matrix, (row_idx, buckets[feature_idx]), signs[feature_idx])
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        return matrix.astype(np.float32).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
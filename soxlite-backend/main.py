@@ -1,42 +1,80 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
-from io import BytesIO
+from io import BytesIO, StringIO
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-import shutil
 import requests
 import json
+import csv
+import re
 import hashlib
 import jwt
+import threading
+import time
+import uuid
 from typing import Optional
-from collections import Counter
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import asyncio
+import httpx
+import openai
+import chromadb
 
-from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.prompts import PromptTemplate
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings, OpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 
-import matplotlib.pyplot as plt
-import matplotlib
+try:
+    from svglib.svglib import svg2rlg
+except ImportError:  # SVG charts need svglib; PNG is used without it
+    svg2rlg = None
+
+from rollup import GRANULARITIES, RollupCube
+from crosstab import crosstab, crosstab_nested
+from metrics_store import MetricsStore
+from upload_index import UploadIndex
+from charts import CHART_FORMATS, CHART_PROFILES, CHART_TITLES, ChartCache, chart_key, render_chart, warm_up_worker, ping
+from llm_cache import LLMResponseCache
+from embeddings import HashingEmbeddings, EMBEDDING_PROVIDERS
+from normalization import COLUMNAR_EXTENSIONS, read_dataframe, load_normalized, views_memory_usage
+from rule_engine import NormalizedFrame, FRAMEWORK_COLUMNS, evaluate_rules, evaluate_rules_chunked, compliance_masks, compliance_counts, critical_issues, owner_performance
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Point at an OpenAI-compatible server (e.g. a local model gateway) for air-gapped deployments
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients.start()
+    EXECUTORS["render"].warm_up(ping)
+    await run_io(sweep_uploads)
+    try:
+        yield
+    finally:
+        embed_jobs.shutdown()
+        for executor in EXECUTORS.values():
+            executor.shutdown()
+        await clients.close()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -47,8 +85,61 @@ app.add_middleware(
 
 UPLOAD_DIR = "uploads"
 CHROMA_DIR = "chroma_db"
+EMBED_MANIFEST_FILE = os.path.join(CHROMA_DIR, "embed_manifest.json")
+PARTITIONS_FILE = os.path.join(CHROMA_DIR, "partitions.json")
+CONVERTED_DIR = os.path.join(UPLOAD_DIR, "parquet")
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+UPLOAD_INDEX_FILE = os.path.join(UPLOAD_DIR, "index.db")
+# Index written by earlier versions; imported into UPLOAD_INDEX_FILE on startup
+LEGACY_UPLOAD_INDEX_FILE = os.path.join(UPLOAD_DIR, "index.json")
+UPLOAD_MAX_VERSIONS = int(os.getenv("UPLOAD_MAX_VERSIONS", "10"))
+UPLOAD_RETENTION_DAYS = int(os.getenv("UPLOAD_RETENTION_DAYS", "90"))
+UPLOAD_TMP_MAX_AGE_SECONDS = int(os.getenv("UPLOAD_TMP_MAX_AGE_SECONDS", "3600"))
+DATASET_CACHE_MAX_ENTRIES = int(os.getenv("DATASET_CACHE_MAX_ENTRIES", "32"))
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+DATASET_CACHE_TTL_SECONDS = int(os.getenv("DATASET_CACHE_TTL_SECONDS", "3600"))
+DATASET_AGGREGATES_MAX_ENTRIES = int(os.getenv("DATASET_AGGREGATES_MAX_ENTRIES", "32"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_ROWS_PER_DOCUMENT = int(os.getenv("EMBED_ROWS_PER_DOCUMENT", "1"))
+STREAMING_CHUNK_ROWS = int(os.getenv("STREAMING_CHUNK_ROWS", "50000"))
+STREAMING_THRESHOLD_BYTES = int(os.getenv("STREAMING_THRESHOLD_BYTES", str(100 * 1024 * 1024)))
+CHART_PROFILE = os.getenv("CHART_PROFILE", "print")
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png")
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "256"))
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+HEATMAP_TOP_K = int(os.getenv("HEATMAP_TOP_K", "20"))
+HEATMAP_MAX_CELLS = int(os.getenv("HEATMAP_MAX_CELLS", "2000"))
+REPORT_DIR = "reports"
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "30"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+EMBED_MAX_PENDING_JOBS = int(os.getenv("EMBED_MAX_PENDING_JOBS", "20"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+EMBED_RETRY_BACKOFF_SECONDS = float(os.getenv("EMBED_RETRY_BACKOFF_SECONDS", "1"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "512"))
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "llm_cache.db")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+METRICS_DB_FILE = os.getenv("METRICS_DB_FILE", "metrics.db")
+BENCHMARK_WINDOW_DAYS = int(os.getenv("BENCHMARK_WINDOW_DAYS", "90"))
+# Workers and queue limits per workload class, see the Executors section
+CPU_COUNT = os.cpu_count() or 1
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, CPU_COUNT))))
+PARSE_QUEUE_LIMIT = int(os.getenv("PARSE_QUEUE_LIMIT", "16"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, CPU_COUNT))))
+RENDER_QUEUE_LIMIT = int(os.getenv("RENDER_QUEUE_LIMIT", "32"))
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", str(CPU_COUNT)))
+COMPUTE_QUEUE_LIMIT = int(os.getenv("COMPUTE_QUEUE_LIMIT", "64"))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "32"))
+IO_QUEUE_LIMIT = int(os.getenv("IO_QUEUE_LIMIT", "256"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(CHROMA_DIR, exist_ok=True)
+os.makedirs(CONVERTED_DIR, exist_ok=True)
+os.makedirs(BLOB_DIR, exist_ok=True)
+os.makedirs(REPORT_DIR, exist_ok=True)
 
 # User storage (in production, use a proper database)
 USERS_FILE = "users.json"
@@ -81,6 +172,7 @@ def verify_jwt_token(token: str) -> Optional[str]:
         return None
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     username = verify_jwt_token(credentials.credentials)
@@ -88,6 +180,17 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         raise HTTPException(status_code=401, detail="Invalid token")
     return username
 
+def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)) -> Optional[str]:
+    """Like get_current_user, but requests without a valid token are allowed through as anonymous (None)."""
+    if credentials is None:
+        return None
+    return verify_jwt_token(credentials.credentials) or None
+
+def get_admin_user(current_user: str = Depends(get_current_user)) -> str:
+    if current_user not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 @app.post("/signup")
 async def signup(username: str = Form(...), password: str = Form(...)):
     users = load_users()
@@ -126,15 +229,204 @@ async def login(username: str = Form(...), password: str = Form(...)):
 async def verify_token(current_user: str = Depends(get_current_user)):
     return {"username": current_user, "valid": True}
 
-# --- Utility ---
-def save_versioned_file(file: UploadFile) -> str:
-    name, ext = os.path.splitext(file.filename)
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    versioned_path = os.path.join(UPLOAD_DIR, f"{name}_{timestamp}{ext}")
-    with open(versioned_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    return versioned_path
+# --- Executors ---
+class ExecutorBusy(HTTPException):
+    def __init__(self, name: str):
+        super().__init__(status_code=503, detail=f"Server busy ({name} queue is full), please retry shortly")
+
+class WorkloadExecutor:
+    """
+    Runs one class of blocking work off the event loop. At most `workers` tasks
+    run at once and up to `queue_limit` more wait; beyond that run() raises
+    ExecutorBusy (503) rather than letting requests pile up. Process pools use
+    the spawn start method, so their functions must live in modules without app
+    state (e.g. normalization).
+    """
+
+    def __init__(self, name: str, workers: int, queue_limit: int, processes: bool = False, initializer=None):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.processes = processes
+        self.initializer = initializer
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.processes:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=self.initializer,
+                    )
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self._pool
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_limit:
+                raise ExecutorBusy(self.name)
+            self._in_flight += 1
+        pool = self._get_pool()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for later calls
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def warm_up(self, fn):
+        """Start every worker now by submitting one fn() per worker, without waiting."""
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(fn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": "process" if self.processes else "thread",
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self._in_flight,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+# parse: turning upload bytes into normalized frames, in worker processes.
+# render: rasterizing report charts from their aggregated series, in worker
+#   processes that import matplotlib and load fonts once at startup.
+# compute: pandas, matplotlib and reportlab work on frames already in memory; these
+#   run in threads because shipping cached frames to a process costs more than it saves.
+# io: blocking network and disk calls (OpenAI, Chroma, Slack, upload storage).
+EXECUTORS = {
+    "parse": WorkloadExecutor("parse", PARSE_WORKERS, PARSE_QUEUE_LIMIT, processes=True),
+    "render": WorkloadExecutor("render", RENDER_WORKERS, RENDER_QUEUE_LIMIT, processes=True, initializer=warm_up_worker),
+    "compute": WorkloadExecutor("compute", COMPUTE_WORKERS, COMPUTE_QUEUE_LIMIT),
+    "io": WorkloadExecutor("io", IO_WORKERS, IO_QUEUE_LIMIT),
+}
+
+async def run_parse(fn, *args):
+    return await EXECUTORS["parse"].run(fn, *args)
+
+async def run_render(fn, *args):
+    return await EXECUTORS["render"].run(fn, *args)
+
+async def run_compute(fn, *args):
+    return await EXECUTORS["compute"].run(fn, *args)
+
+async def run_io(fn, *args):
+    return await EXECUTORS["io"].run(fn, *args)
+
+# --- Upload storage ---
+# Uploads are stored once per distinct content under BLOB_DIR as <sha256><ext>.
+# upload_index (UPLOAD_INDEX_FILE) records each filename's versions, newest last.
+# Uploads are spooled to dot-prefixed temp files in BLOB_DIR first; garbage
+# collection leaves those alone until they are UPLOAD_TMP_MAX_AGE_SECONDS old.
+upload_index_lock = threading.Lock()
+upload_index = UploadIndex(UPLOAD_INDEX_FILE, LEGACY_UPLOAD_INDEX_FILE)
+
+def spool_upload(file: UploadFile):
+    """
+    Copy an upload to a temp file in BLOB_DIR, hashing it on the way.
+    Returns (temp path, sha256 hex digest, size).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(BLOB_DIR, f".{uuid.uuid4().hex}.tmp")
+    file.file.seek(0)
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    file.file.seek(0)
+    return tmp_path, digest.hexdigest(), size
+
+def store_upload(filename: str, tmp_path: str, digest: str, size: int) -> str:
+    """
+    Move a spooled upload into the content-addressed blob store and record it in
+    the index. Identical content is kept on disk only once; a repeat upload of the
+    same file just refreshes its index entry. Returns the blob path.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    blob = f"{digest}{ext}"
+    path = os.path.join(BLOB_DIR, blob)
+    # The blob appears under its final name together with its index entry, so
+    # garbage collection (which holds the same lock) never sees it unreferenced
+    with upload_index_lock:
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        if upload_index.record(filename, blob, size):
+            collect_upload_garbage()
+    return path
+
+def collect_upload_garbage(now=None):
+    """
+    Apply the retention policy: keep at most UPLOAD_MAX_VERSIONS per filename,
+    drop versions not seen for UPLOAD_RETENTION_DAYS, then delete blobs (and their
+    converted Parquet copies) that no remaining version references. Converted copies
+    without a blob (datasets that were parsed but never stored) are deleted once
+    unused for UPLOAD_RETENTION_DAYS, and temp files left by interrupted writes once
+    older than UPLOAD_TMP_MAX_AGE_SECONDS. Must be called with upload_index_lock held.
+    Returns the number of blobs removed.
+    """
+    now = now or time.time()
+    cutoff = now - UPLOAD_RETENTION_DAYS * 86400
+    tmp_cutoff = now - UPLOAD_TMP_MAX_AGE_SECONDS
+    upload_index.prune(cutoff, UPLOAD_MAX_VERSIONS)
+
+    referenced = upload_index.blobs()
+    removed = 0
+    for blob in os.listdir(BLOB_DIR):
+        path = os.path.join(BLOB_DIR, blob)
+        if blob.startswith("."):
+            if blob.endswith(".tmp") and os.path.getmtime(path) < tmp_cutoff:
+                os.remove(path)
+            continue
+        if blob in referenced:
+            continue
+        os.remove(path)
+        converted = converted_path(os.path.splitext(blob)[0])
+        if os.path.exists(converted):
+            os.remove(converted)
+        removed += 1
+
+    blob_ids = {os.path.splitext(blob)[0] for blob in os.listdir(BLOB_DIR) if not blob.startswith(".")}
+    for name in os.listdir(CONVERTED_DIR):
+        path = os.path.join(CONVERTED_DIR, name)
+        dataset_id, ext = os.path.splitext(name)
+        if ext == ".tmp":
+            if os.path.getmtime(path) < tmp_cutoff:
+                os.remove(path)
+        elif ext == ".parquet" and dataset_id not in blob_ids and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+    return removed
+
+def sweep_uploads():
+    """Apply the retention policy outside of an upload, e.g. at startup."""
+    with upload_index_lock:
+        return collect_upload_garbage()
 
+# --- Utility ---
 def send_slack_alerts(alerts, mode="sox"):
     if SLACK_WEBHOOK_URL:
         mode_text = "SOX" if mode == "sox" else "ESG"
@@ -146,734 +438,1338 @@ def send_slack_alerts(alerts, mode="sox"):
         except:
             pass
 
-def detect_anomalies_df(df: pd.DataFrame, mode="sox"):
-    anomalies = []
-    
-    if mode == "sox":
-        # SOX anomaly detection
-        if "Risk Rating" in df.columns and "Result" in df.columns:
-            failed_low = df[
-                (df["Risk Rating"].str.lower() == "low") &
-                (df["Result"].str.lower().str.contains("fail"))
-            ]
-            if not failed_low.empty:
-                anomalies.append("Low-risk controls have failed results.")
+def detect_anomalies_df(df: pd.DataFrame, mode="sox", views=None):
+    anomalies, _ = evaluate_rules(df, mode, views=views)
+    return anomalies or ["No anomalies detected."]
 
-        if "Risk Rating" in df.columns and "Frequency" in df.columns:
-            high_rare = df[
-                (df["Risk Rating"].str.lower() == "high") &
-                (df["Frequency"].str.lower().str.contains("annual|rare"))
-            ]
-            if not high_rare.empty:
-                anomalies.append("High-risk controls have rare testing frequencies.")
-
-        if "Owner" in df.columns:
-            missing_owner = df[df["Owner"].isnull() | df["Owner"].astype(str).str.strip().eq("")]
-            if not missing_owner.empty:
-                anomalies.append(f"{len(missing_owner)} control(s) have no assigned owner.")
-
-        if "Result" in df.columns:
-            missing_result = df[df["Result"].isnull() | df["Result"].astype(str).str.strip().eq("")]
-            if not missing_result.empty:
-                anomalies.append(f"{len(missing_result)} control(s) have no result recorded.")
-
-        if "Due Date" in df.columns:
-            due_dates = pd.to_datetime(df["Due Date"], errors="coerce")
-            overdue = due_dates < pd.Timestamp.now()
-            if overdue.any():
-                anomalies.append(f"{overdue.sum()} control(s) are overdue.")
-            if due_dates.isna().sum() > 0:
-                anomalies.append(f"{due_dates.isna().sum()} control(s) have invalid or missing due dates.")
-
-        if "Risk Rating" in df.columns and "Frequency" in df.columns:
-            high_no_freq = df[
-                (df["Risk Rating"].str.lower() == "high") &
-                (df["Frequency"].isnull() | df["Frequency"].astype(str).str.strip().eq(""))
-            ]
-            if not high_no_freq.empty:
-                anomalies.append(f"{len(high_no_freq)} high-risk control(s) have no testing frequency set.")
+# --- Dataset cache ---
+class DatasetCache:
+    """
+    In-process LRU cache of parsed, normalized DataFrames keyed by content hash.
+    Entries are evicted when the cache exceeds its entry count or memory budget,
+    and expire after the configured TTL.
+    """
 
-        if "GL Code" in df.columns:
-            dupes = df["GL Code"][df["GL Code"].duplicated()]
-            if not dupes.empty:
-                anomalies.append(f"{len(dupes)} control(s) have duplicate GL Codes.")
-    
-    elif mode == "esg":
-        # ESG anomaly detection
-        if "ESG Factor" in df.columns and "Status" in df.columns:
-            failed_status = df[
-                (df["Status"].str.lower().str.contains("fail"))
-            ]
-            if not failed_status.empty:
-                anomalies.append(f"{len(failed_status)} ESG metric(s) have failed status.")
-
-        if "Value" in df.columns and "Threshold" in df.columns:
-            # Convert to numeric, handling any non-numeric values
-            df_numeric = df.copy()
-            df_numeric["Value"] = pd.to_numeric(df_numeric["Value"], errors="coerce")
-            df_numeric["Threshold"] = pd.to_numeric(df_numeric["Threshold"], errors="coerce")
-            
-            below_threshold = df_numeric[
-                (df_numeric["Value"] < df_numeric["Threshold"]) & 
-                (df_numeric["Value"].notna()) & 
-                (df_numeric["Threshold"].notna())
-            ]
-            if not below_threshold.empty:
-                anomalies.append(f"{len(below_threshold)} ESG metric(s) are below threshold.")
-
-        if "Owner" in df.columns:
-            missing_owner = df[df["Owner"].isnull() | df["Owner"].astype(str).str.strip().eq("")]
-            if not missing_owner.empty:
-                anomalies.append(f"{len(missing_owner)} ESG metric(s) have no assigned owner.")
-
-        if "Status" in df.columns:
-            missing_status = df[df["Status"].isnull() | df["Status"].astype(str).str.strip().eq("")]
-            if not missing_status.empty:
-                anomalies.append(f"{len(missing_status)} ESG metric(s) have no status recorded.")
-
-        if "Due Date" in df.columns:
-            due_dates = pd.to_datetime(df["Due Date"], errors="coerce")
-            overdue = due_dates < pd.Timestamp.now()
-            if overdue.any():
-                anomalies.append(f"{overdue.sum()} ESG metric(s) are overdue.")
-            if due_dates.isna().sum() > 0:
-                anomalies.append(f"{due_dates.isna().sum()} ESG metric(s) have invalid or missing due dates.")
-
-        if "ESG Factor" in df.columns:
-            dupes = df["ESG Factor"][df["ESG Factor"].duplicated()]
-            if not dupes.empty:
-                anomalies.append(f"{len(dupes)} ESG metric(s) have duplicate factors.")
-
-    elif mode == "soc2":
-        # SOC 2 anomaly detection
-        if "Trust Service Criteria" in df.columns and "Status" in df.columns:
-            failed_status = df[
-                (df["Status"].str.lower().str.contains("fail"))
-            ]
-            if not failed_status.empty:
-                anomalies.append(f"{len(failed_status)} SOC 2 control(s) have failed status.")
-
-        if "Control Type" in df.columns:
-            missing_controls = df[df["Control Type"].isnull() | df["Control Type"].astype(str).str.strip().eq("")]
-            if not missing_controls.empty:
-                anomalies.append(f"{len(missing_controls)} control(s) have no control type specified.")
-
-        if "Owner" in df.columns:
-            missing_owner = df[df["Owner"].isnull() | df["Owner"].astype(str).str.strip().eq("")]
-            if not missing_owner.empty:
-                anomalies.append(f"{len(missing_owner)} control(s) have no assigned owner.")
-
-        if "Status" in df.columns:
-            missing_status = df[df["Status"].isnull() | df["Status"].astype(str).str.strip().eq("")]
-            if not missing_status.empty:
-                anomalies.append(f"{len(missing_status)} control(s) have no status recorded.")
-
-        if "Last Test Date" in df.columns:
-            test_dates = pd.to_datetime(df["Last Test Date"], errors="coerce")
-            old_tests = test_dates < (pd.Timestamp.now() - pd.Timedelta(days=90))
-            if old_tests.any():
-                anomalies.append(f"{old_tests.sum()} control(s) haven't been tested in over 90 days.")
-            if test_dates.isna().sum() > 0:
-                anomalies.append(f"{test_dates.isna().sum()} control(s) have no test date recorded.")
-
-        if "Trust Service Criteria" in df.columns:
-            # Check for controls covering all TSC categories
-            tsc_categories = ["CC", "DC", "AI", "PR", "SL"]
-            missing_tsc = []
-            for tsc in tsc_categories:
-                if not df[df["Trust Service Criteria"].str.contains(tsc, na=False, case=False)].empty:
-                    continue
-                missing_tsc.append(tsc)
-            if missing_tsc:
-                anomalies.append(f"Missing controls for Trust Service Criteria: {', '.join(missing_tsc)}")
-
-        if "Control ID" in df.columns:
-            dupes = df["Control ID"][df["Control ID"].duplicated()]
-            if not dupes.empty:
-                anomalies.append(f"{len(dupes)} control(s) have duplicate Control IDs.")
-
-    elif mode == "iso27001":
-        # ISO 27001 anomaly detection
-        if "Status" in df.columns:
-            failed = df[df["Status"].str.lower().str.contains("fail|not implemented", na=False)]
-            if not failed.empty:
-                anomalies.append(f"{len(failed)} controls are failed or not implemented.")
-        if "Last Review Date" in df.columns:
-            review_dates = pd.to_datetime(df["Last Review Date"], errors="coerce")
-            overdue = review_dates < (pd.Timestamp.now() - pd.Timedelta(days=365))
-            if overdue.any():
-                anomalies.append(f"{overdue.sum()} controls have not been reviewed in over 12 months.")
-            if review_dates.isna().sum() > 0:
-                anomalies.append(f"{review_dates.isna().sum()} controls have no review date recorded.")
-        if "Evidence" in df.columns:
-            missing_evidence = df[df["Evidence"].isnull() | df["Evidence"].astype(str).str.strip().eq("")]
-            if not missing_evidence.empty:
-                anomalies.append(f"{len(missing_evidence)} controls are missing evidence.")
-        if "Control Owner" in df.columns:
-            missing_owner = df[df["Control Owner"].isnull() | df["Control Owner"].astype(str).str.strip().eq("")]
-            if not missing_owner.empty:
-                anomalies.append(f"{len(missing_owner)} controls are missing assigned owners.")
-        if "Annex A Reference" in df.columns:
-            missing_annex = df[df["Annex A Reference"].isnull() | df["Annex A Reference"].astype(str).str.strip().eq("")]
-            if not missing_annex.empty:
-                anomalies.append(f"{len(missing_annex)} controls are missing Annex A references.")
-        if "Control ID" in df.columns:
-            dupes = df["Control ID"][df["Control ID"].duplicated()]
-            if not dupes.empty:
-                anomalies.append(f"{len(dupes)} controls have duplicate Control IDs.")
+    def __init__(self, max_entries, max_bytes, ttl_seconds):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, dataset_id):
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["created"] > self.ttl_seconds:
+                self._remove(dataset_id)
+                return None
+            self._entries.move_to_end(dataset_id)
+            return entry
+
+    def put(self, dataset_id, df, filename, views=None):
+        views = views or {}
+        size = int(df.memory_usage(deep=True).sum()) + views_memory_usage(views)
+        entry = {"df": df, "views": views, "filename": filename, "size": size, "created": time.monotonic(), "aggregates": OrderedDict()}
+        with self._lock:
+            if dataset_id in self._entries:
+                self._remove(dataset_id)
+            self._entries[dataset_id] = entry
+            self._total_bytes += size
+            self._evict()
+        return entry
+
+    def _remove(self, dataset_id):
+        entry = self._entries.pop(dataset_id)
+        self._total_bytes -= entry["size"]
+
+    def _evict(self):
+        now = time.monotonic()
+        for dataset_id in [k for k, e in self._entries.items() if now - e["created"] > self.ttl_seconds]:
+            self._remove(dataset_id)
+        # Always keep the most recent entry, even if it alone exceeds the byte budget
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+dataset_cache = DatasetCache(DATASET_CACHE_MAX_ENTRIES, DATASET_CACHE_MAX_BYTES, DATASET_CACHE_TTL_SECONDS)
+
+dataset_aggregates_lock = threading.Lock()
+
+def dataset_aggregate(entry, key, build):
+    """
+    Build a derived aggregate once per cached dataset; it is dropped along with the
+    entry. Each dataset keeps its DATASET_AGGREGATES_MAX_ENTRIES most recently used
+    aggregates, since keys such as heatmap column pairs come from requests.
+    """
+    aggregates = entry["aggregates"]
+    with dataset_aggregates_lock:
+        if key in aggregates:
+            aggregates.move_to_end(key)
+            return aggregates[key]
+    value = build()
+    with dataset_aggregates_lock:
+        aggregates[key] = value
+        aggregates.move_to_end(key)
+        while len(aggregates) > DATASET_AGGREGATES_MAX_ENTRIES:
+            aggregates.popitem(last=False)
+    return value
+
+# --- Converted-format cache ---
+# CSV and Excel uploads are stored as Parquet under CONVERTED_DIR, keyed by content hash,
+# so later requests for the same bytes (or an evicted dataset_id) load columnar data instead.
+def converted_path(dataset_id: str) -> str:
+    return os.path.join(CONVERTED_DIR, f"{dataset_id}.parquet")
+
+async def load_converted(dataset_id: str):
+    """Parse and normalize a converted Parquet copy; returns (df, views, attrs) or None."""
+    path = converted_path(dataset_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        # Mark the copy as used so garbage collection keeps it
+        os.utime(path)
+        return await run_parse(load_normalized, path, path)
+    except ExecutorBusy:
+        raise
+    except Exception as e:
+        print(f"Error reading converted dataset {dataset_id}: {str(e)}")
+        return None
 
-    return anomalies or ["No anomalies detected."]
+def save_converted(dataset_id: str, df: pd.DataFrame, filename: str):
+    path = converted_path(dataset_id)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        df = df.copy(deep=False)
+        df.attrs["filename"] = filename
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        # Columns pyarrow cannot represent (e.g. mixed types) just skip the cache
+        print(f"Could not store {filename} as Parquet: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-# --- Embedding ---
-def embed_file(path: str, mode="sox"):
-    ext = path.split('.')[-1].lower()
-    df = pd.read_csv(path) if ext == "csv" else pd.read_excel(path, engine="openpyxl")
-    text = df.to_csv(index=False)
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = splitter.split_text(text)
-    documents = [Document(page_content=chunk) for chunk in chunks]
-    Chroma.from_documents(
-        documents,
-        OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY),
-        persist_directory=CHROMA_DIR
-    )
+async def register_dataset(source, filename: str, digest: Optional[str] = None):
+    """
+    Parse and cache an upload under its SHA-256 digest. `source` is the raw bytes
+    or a path to them; callers that already hashed the content pass the digest.
+    """
+    dataset_id = digest or await run_io(lambda: hashlib.sha256(source).hexdigest())
+    entry = dataset_cache.get(dataset_id)
+    if entry is None:
+        converted = await load_converted(dataset_id)
+        if converted is not None:
+            df, views, _ = converted
+        else:
+            df, views, _ = await run_parse(load_normalized, source, filename)
+            if filename.split('.')[-1].lower() not in COLUMNAR_EXTENSIONS:
+                await run_io(save_converted, dataset_id, df, filename)
+        entry = dataset_cache.put(dataset_id, df, filename, views)
+    return dataset_id, entry
+
+async def restore_dataset(dataset_id: str):
+    """Reload a dataset evicted from memory from its converted Parquet copy, if there is one."""
+    if not re.fullmatch(r"[0-9a-f]{64}", dataset_id):
+        return None
+    converted = await load_converted(dataset_id)
+    if converted is None:
+        return None
+    df, views, attrs = converted
+    filename = attrs.get("filename", f"{dataset_id}.parquet")
+    return dataset_cache.put(dataset_id, df, filename, views)
 
-@app.post("/auto-embed/")
-async def auto_embed(file: UploadFile = File(...), mode: str = Form("sox")):
+async def load_dataset(file: Optional[UploadFile], dataset_id: Optional[str], store: bool = False):
+    """
+    Resolve a request's dataset either from a previously registered dataset ID
+    or from an uploaded file. Uploaded files are registered too, so repeat uploads
+    of identical bytes skip parsing, and with `store` also kept in the upload
+    store. The returned DataFrame is shared and must not be mutated in place.
+    """
+    if dataset_id:
+        entry = dataset_cache.get(dataset_id) or await restore_dataset(dataset_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Dataset not found or expired, please upload it again")
+        return dataset_id, entry
+    if file is None:
+        raise HTTPException(status_code=400, detail="Either a file or a dataset_id is required")
+    return await register_upload(file, store)
+
+async def register_upload(file: UploadFile, store: bool = False):
+    """Spool, hash and register an upload; with `store` it is also kept in the upload store."""
+    tmp_path, digest, size = await run_io(spool_upload, file)
     try:
-        file.file.seek(0)
-        path = save_versioned_file(file)
-        embed_file(path, mode)
-        return {"status": "success"}
+        source = tmp_path
+        if store:
+            source = await run_io(store_upload, file.filename, tmp_path, digest, size)
+        return await register_dataset(source, file.filename, digest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def should_stream(file: Optional[UploadFile], dataset_id: Optional[str], stream: bool) -> bool:
+    """CSV uploads are evaluated chunk by chunk when requested or when they exceed STREAMING_THRESHOLD_BYTES."""
+    if dataset_id or file is None or file.filename.split('.')[-1].lower() != "csv":
+        return False
+    if stream:
+        return True
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size > STREAMING_THRESHOLD_BYTES
+
+def stream_rules(file: UploadFile, mode="sox"):
+    # Read everything as text so a column's values compare the same way in every chunk
+    file.file.seek(0)
+    chunks = pd.read_csv(file.file, chunksize=STREAMING_CHUNK_ROWS, dtype=str)
+    return evaluate_rules_chunked(chunks, mode)
+
+@app.post("/datasets")
+async def create_dataset(file: UploadFile = File(...)):
+    try:
+        dataset_id, entry = await register_upload(file)
+        df = entry["df"]
+        return {"dataset_id": dataset_id, "filename": entry["filename"], "rows": len(df), "columns": list(df.columns)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error registering dataset: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": f"Failed to parse dataset: {str(e)}"})
+
+# --- Client registry ---
+class ClientRegistry:
+    """
+    Process-wide OpenAI and Chroma clients. The app lifespan opens pooled sync and
+    async HTTP sessions and a single persistent Chroma client at startup and closes
+    them at shutdown; the OpenAI clients, LLM, embeddings and per-collection vector
+    stores built on top are created on first use and reused by every request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.http_client = None
+        self.async_http_client = None
+        self.chroma_client = None
+        self._openai = None
+        self._llm = None
+        self._embeddings = {}
+        self._vectorstores = {}
+
+    def start(self):
+        with self._lock:
+            limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+            if self.http_client is None:
+                self.http_client = httpx.Client(timeout=OPENAI_TIMEOUT_SECONDS, limits=limits)
+            if self.async_http_client is None:
+                self.async_http_client = httpx.AsyncClient(timeout=OPENAI_TIMEOUT_SECONDS, limits=limits)
+            if self.chroma_client is None:
+                self.chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
+
+    async def close(self):
+        with self._lock:
+            self._vectorstores.clear()
+            self._llm = None
+            self._openai = None
+            self._embeddings.clear()
+            self.chroma_client = None
+            http_client, self.http_client = self.http_client, None
+            async_http_client, self.async_http_client = self.async_http_client, None
+        if http_client is not None:
+            http_client.close()
+        if async_http_client is not None:
+            await async_http_client.aclose()
+
+    def _openai_clients(self):
+        # Built lazily so deployments using only local embeddings start without an API key.
+        # The sync and async clients are passed to LangChain explicitly because it would
+        # otherwise hand the same http_client to both.
+        if self._openai is None:
+            self._openai = (
+                openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=self.http_client),
+                openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=self.async_http_client),
+            )
+        return self._openai
+
+    def llm(self):
+        self.start()
+        with self._lock:
+            if self._llm is None:
+                sync_client, async_client = self._openai_clients()
+                self._llm = OpenAI(
+                    openai_api_key=OPENAI_API_KEY,
+                    client=sync_client.completions,
+                    async_client=async_client.completions,
+                )
+            return self._llm
+
+    def embeddings(self, provider: Optional[str] = None):
+        """Embedding model for `provider` ("openai" or "hashing"), defaulting to EMBEDDING_PROVIDER."""
+        provider = provider or EMBEDDING_PROVIDER
+        if provider not in EMBEDDING_PROVIDERS:
+            raise ValueError(f"Unknown embedding provider '{provider}', expected one of {', '.join(EMBEDDING_PROVIDERS)}")
+        self.start()
+        with self._lock:
+            if provider not in self._embeddings:
+                if provider == "hashing":
+                    self._embeddings[provider] = HashingEmbeddings(dim=HASHING_EMBEDDING_DIM)
+                else:
+                    sync_client, async_client = self._openai_clients()
+                    self._embeddings[provider] = OpenAIEmbeddings(
+                        openai_api_key=OPENAI_API_KEY,
+                        client=sync_client.embeddings,
+                        async_client=async_client.embeddings,
+                    )
+            return self._embeddings[provider]
+
+    def vectorstore(self, collection_name: str):
+        embeddings = self.embeddings()
+        with self._lock:
+            vectordb = self._vectorstores.get(collection_name)
+            if vectordb is None:
+                vectordb = Chroma(
+                    client=self.chroma_client,
+                    collection_name=collection_name,
+                    persist_directory=CHROMA_DIR,
+                    embedding_function=embeddings,
+                )
+                self._vectorstores[collection_name] = vectordb
+            return vectordb
+
+    def drop_vectorstore(self, collection_name: str):
+        vectordb = self.vectorstore(collection_name)
+        vectordb.delete_collection()
+        with self._lock:
+            self._vectorstores.pop(collection_name, None)
+
+clients = ClientRegistry()
+
+# --- LLM response cache ---
+llm_cache = LLMResponseCache(LLM_CACHE_FILE, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
+
+def _llm_cache_key(ai, template: str, mode: str, data_hash: str) -> str:
+    return llm_cache.make_key(getattr(ai, "model_name", type(ai).__name__), template, mode, data_hash)
+
+def invoke_llm_cached(template: str, mode: str, data_hash: str, data: str) -> str:
+    """
+    Invoke the shared LLM on `template` followed by `data`, reusing a cached response
+    for the same model, template, mode and data. `data_hash` identifies the data,
+    e.g. the dataset_id of the upload it was taken from.
+    """
+    ai = clients.llm()
+    key = _llm_cache_key(ai, template, mode, data_hash)
+    response = llm_cache.get(key)
+    if response is None:
+        response = ai.invoke(template + data)
+        llm_cache.put(key, response)
+    return response
+
+async def ainvoke_llm_cached(template: str, mode: str, data_hash: str, data: str) -> str:
+    """Async variant of invoke_llm_cached, so several calls can be in flight at once."""
+    ai = clients.llm()
+    key = _llm_cache_key(ai, template, mode, data_hash)
+    response = llm_cache.get(key)
+    if response is None:
+        response = await ai.ainvoke(template + data)
+        llm_cache.put(key, response)
+    return response
+
+# --- Vector store partitions ---
+# Each user gets one Chroma collection per framework mode, so retrieval only ever
+# searches the caller's own documents. PARTITIONS_FILE maps collection names back
+# to their user and mode for the admin endpoints.
+partitions_lock = threading.Lock()
+
+def partition_name(user: Optional[str], mode: str) -> str:
+    # Collection names are restricted to [a-zA-Z0-9._-], so the user is hashed
+    mode_key = re.sub(r"[^a-z0-9]", "", mode.lower()) or "sox"
+    user_key = hashlib.sha256((user or "anonymous").encode()).hexdigest()[:16]
+    # Vectors from different providers are not comparable, so each gets its own collections
+    if EMBEDDING_PROVIDER != "openai":
+        return f"{mode_key}-{user_key}-{EMBEDDING_PROVIDER}"
+    return f"{mode_key}-{user_key}"
+
+def load_partitions():
+    if os.path.exists(PARTITIONS_FILE):
+        with open(PARTITIONS_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_partitions(partitions):
+    tmp_path = f"{PARTITIONS_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(partitions, f)
+    os.replace(tmp_path, PARTITIONS_FILE)
+
+def register_partition(name: str, user: Optional[str], mode: str):
+    with partitions_lock:
+        partitions = load_partitions()
+        if name not in partitions:
+            partitions[name] = {"user": user or "anonymous", "mode": mode, "created_at": datetime.now().isoformat()}
+            save_partitions(partitions)
+
+# The manifest records which chunk IDs are in the vector store for each source
+# ("<partition>:<filename>"), so re-embedding a file only touches chunks that changed.
+embed_manifest_lock = threading.Lock()
+
+def load_embed_manifest():
+    if os.path.exists(EMBED_MANIFEST_FILE):
+        with open(EMBED_MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_embed_manifest(manifest):
+    tmp_path = f"{EMBED_MANIFEST_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, EMBED_MANIFEST_FILE)
+
+def update_embed_manifest(source: str, chunk_ids):
+    with embed_manifest_lock:
+        manifest = load_embed_manifest()
+        if chunk_ids:
+            manifest[source] = sorted(chunk_ids)
+        else:
+            manifest.pop(source, None)
+        save_embed_manifest(manifest)
+
+def chunk_id(source: str, text: str) -> str:
+    return hashlib.sha256(f"{source}\0{text}".encode()).hexdigest()
+
+# Metadata attached to each document, taken from the first candidate column present
+DOCUMENT_METADATA_COLUMNS = {
+    "control_id": ["Control ID", "Metric ID"],
+    "owner": ["Owner", "Control Owner"],
+    "status": ["Result", "Status"],
+    "risk": ["Risk Rating", "Priority", "ESG Factor", "Trust Service Criteria"],
+}
+
+def build_documents(df: pd.DataFrame, mode="sox", dataset_id=None, filename=None, rows_per_document=None):
+    """
+    Split a dataset into row-aligned documents for the vector store. Each document is
+    the CSV header followed by up to `rows_per_document` rows, so chunks never cut
+    through a row and always say what each value means. Metadata carries the mode,
+    dataset and source, the first row's position and, when every row in the document
+    agrees on them, its control ID, owner, status and risk.
+    Returns a list of (text, metadata) pairs.
+    """
+    rows_per_document = max(1, rows_per_document or EMBED_ROWS_PER_DOCUMENT)
+    columns = list(df.columns)
+    metadata_columns = {}
+    for key, candidates in DOCUMENT_METADATA_COLUMNS.items():
+        col = next((c for c in candidates if c in columns), None)
+        if col is not None:
+            metadata_columns[key] = columns.index(col)
+
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    header = buffer.getvalue()
+
+    values = df.astype(object).where(df.notna(), "").itertuples(index=False, name=None)
+    documents = []
+    group = []
+    for position, row in enumerate(values):
+        group.append(row)
+        if len(group) == rows_per_document or position == len(df) - 1:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(group)
+            metadata = {"mode": mode, "source": filename or "", "dataset_id": dataset_id or "", "row": position - len(group) + 1}
+            for key, index in metadata_columns.items():
+                shared = {str(r[index]) for r in group}
+                if len(shared) == 1 and "" not in shared:
+                    metadata[key] = shared.pop()
+            documents.append((header + buffer.getvalue(), metadata))
+            group = []
+    return documents
+
+def embed_file(path: str, mode="sox", user=None):
+    df = read_dataframe(path, path)
+    return embed_dataframe(df, mode, os.path.basename(path), user=user)
+
+class JobCancelled(Exception):
+    pass
+
+def with_retries(fn, cancel_event=None):
+    """
+    Call fn, retrying up to EMBED_MAX_RETRIES times with exponential backoff.
+    Waiting stops early if cancel_event is set.
+    """
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = EMBED_RETRY_BACKOFF_SECONDS * 2 ** attempt
+            print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+            if cancel_event is None:
+                time.sleep(delay)
+            elif cancel_event.wait(delay):
+                raise JobCancelled()
+
+def embed_dataframe(df: pd.DataFrame, mode="sox", filename=None, dataset_id=None, user=None, progress=None, cancel_event=None):
+    """
+    Incrementally sync a dataset's documents into the vector store. Documents are
+    identified by a hash of their source and text: unchanged ones are skipped, new ones
+    are embedded in batches of EMBED_BATCH_SIZE, and ones no longer present are deleted.
+    A kept document retains the dataset_id of the upload that first introduced it.
+    Documents go to the (user, mode) partition. Returns counts of added, skipped and
+    removed chunks.
+
+    progress(done, total) is called as chunks are synced; setting cancel_event stops
+    the run between batches with JobCancelled. Each batch is retried with backoff.
+    """
+    collection_name = partition_name(user, mode)
+    source = f"{collection_name}:{filename or 'dataset'}"
+    chunks = {}
+    for text, metadata in build_documents(df, mode, dataset_id, filename):
+        chunks.setdefault(chunk_id(source, text), (text, metadata))
+
+    with embed_manifest_lock:
+        existing = set(load_embed_manifest().get(source, []))
+    new_ids = [i for i in chunks if i not in existing]
+    removed_ids = [i for i in existing if i not in chunks]
+    done = len(chunks) - len(new_ids)
+    if progress:
+        progress(done, len(chunks))
+    if not new_ids and not removed_ids:
+        return {"added": 0, "skipped": len(chunks), "removed": 0}
+
+    register_partition(collection_name, user, mode)
+    vectordb = clients.vectorstore(collection_name)
+    if removed_ids:
+        with_retries(lambda: vectordb.delete(ids=removed_ids), cancel_event)
+    stored = existing - set(removed_ids)
+    try:
+        for start in range(0, len(new_ids), EMBED_BATCH_SIZE):
+            if cancel_event is not None and cancel_event.is_set():
+                raise JobCancelled()
+            batch = new_ids[start:start + EMBED_BATCH_SIZE]
+            with_retries(lambda: vectordb.add_texts([chunks[i][0] for i in batch], metadatas=[chunks[i][1] for i in batch], ids=batch), cancel_event)
+            stored.update(batch)
+            done += len(batch)
+            if progress:
+                progress(done, len(chunks))
+    finally:
+        # Written once per run, failed or cancelled ones included, so the next run
+        # resumes after the last stored batch without rewriting the manifest per batch
+        update_embed_manifest(source, stored)
+    return {"added": len(new_ids), "skipped": len(chunks) - len(new_ids), "removed": len(removed_ids)}
+
+# --- Background jobs ---
+class JobQueue:
+    """
+    Runs embedding jobs on a bounded thread pool and tracks their state for polling.
+    Finished jobs are kept for JOB_TTL_SECONDS.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, owner: Optional[str], fn, **info):
+        """
+        Queue fn(progress, cancel_event) and return the job's public state. Returns
+        None when too many jobs are already waiting or running.
+        """
+        now = time.time()
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job["finished"] and now - job["finished"] > JOB_TTL_SECONDS]:
+                del self._jobs[job_id]
+            pending = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                return None
+            job_id = uuid.uuid4().hex
+            job = {
+                "id": job_id, "owner": owner, "status": "queued", "done": 0, "total": None,
+                "result": None, "error": None, "created": now, "finished": None,
+                "info": info, "cancel_event": threading.Event(), "future": None,
+            }
+            self._jobs[job_id] = job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed")
+            job["future"] = self._executor.submit(self._run, job, fn)
+            return self._public(job)
+
+    def _run(self, job, fn):
+        with self._lock:
+            if job["status"] != "queued":
+                return
+            job["status"] = "running"
+
+        def progress(done, total):
+            with self._lock:
+                job["done"], job["total"] = done, total
+
+        try:
+            result = fn(progress, job["cancel_event"])
+            status, error = "succeeded", None
+        except JobCancelled:
+            result, status, error = None, "cancelled", None
+        except Exception as e:
+            print(f"Job {job['id']} failed: {str(e)}")
+            result, status, error = None, "failed", str(e)
+        with self._lock:
+            job.update(status=status, result=result, error=error, finished=time.time())
+
+    def get(self, job_id: str, owner: Optional[str]):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["owner"] != owner:
+                return None
+            return self._public(job)
+
+    def cancel(self, job_id: str, owner: Optional[str]):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["owner"] != owner:
+                return None
+            if job["status"] == "queued" and job["future"].cancel():
+                job.update(status="cancelled", finished=time.time())
+            elif job["status"] in ("queued", "running"):
+                # Running jobs stop at the next batch boundary
+                job["cancel_event"].set()
+            return self._public(job)
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job["cancel_event"].set()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _public(job):
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "chunks_done": job["done"],
+            "chunks_total": job["total"],
+            "cancel_requested": job["cancel_event"].is_set(),
+            "result": job["result"],
+            "error": job["error"],
+            "created_at": datetime.fromtimestamp(job["created"]).isoformat(),
+            "finished_at": datetime.fromtimestamp(job["finished"]).isoformat() if job["finished"] else None,
+            **job["info"],
+        }
+
+embed_jobs = JobQueue(EMBED_WORKERS, EMBED_MAX_PENDING_JOBS)
+
+@app.post("/auto-embed/", status_code=202)
+async def auto_embed(file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None), current_user: Optional[str] = Depends(get_optional_user)):
+    """Queue the dataset for embedding and return a job ID to poll at GET /jobs/{id}."""
+    try:
+        dataset_id, entry = await load_dataset(file, dataset_id, store=True)
+        df, filename = entry["df"], entry["filename"]
+        job = embed_jobs.submit(
+            current_user,
+            lambda progress, cancel_event: embed_dataframe(df, mode, filename, dataset_id, current_user, progress, cancel_event),
+            kind="embed", mode=mode, dataset_id=dataset_id, filename=filename,
+        )
+        if job is None:
+            return JSONResponse(status_code=503, content={"error": "Too many embedding jobs in progress, try again later"})
+        return job
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in auto-embed for {mode}: {str(e)}")
         return JSONResponse(status_code=500, content={"error": f"Failed to embed {mode.upper()} data: {str(e)}"})
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: Optional[str] = Depends(get_optional_user)):
+    job = embed_jobs.get(job_id, current_user)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, current_user: Optional[str] = Depends(get_optional_user)):
+    job = embed_jobs.cancel(job_id, current_user)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def partition_summaries():
+    """Each partition with its sources and document count, both taken from the embedding manifest."""
+    partitions = load_partitions()
+    with embed_manifest_lock:
+        manifest = load_embed_manifest()
+    result = []
+    for name, info in sorted(partitions.items()):
+        sources = {s.split(":", 1)[1]: ids for s, ids in manifest.items() if s.startswith(f"{name}:")}
+        result.append({"name": name, **info, "sources": list(sources), "documents": sum(len(ids) for ids in sources.values())})
+    return result
+
+@app.get("/admin/partitions")
+async def list_partitions(admin: str = Depends(get_admin_user)):
+    return {"partitions": await run_io(partition_summaries)}
+
+def compact_partition_store(name: str):
+    if name not in load_partitions():
+        raise HTTPException(status_code=404, detail="Partition not found")
+    with embed_manifest_lock:
+        manifest = load_embed_manifest()
+    referenced = {i for source, ids in manifest.items() if source.startswith(f"{name}:") for i in ids}
+    vectordb = clients.vectorstore(name)
+    stored = vectordb.get(include=[])["ids"]
+    orphaned = [i for i in stored if i not in referenced]
+    for start in range(0, len(orphaned), EMBED_BATCH_SIZE):
+        vectordb.delete(ids=orphaned[start:start + EMBED_BATCH_SIZE])
+    return {"name": name, "removed": len(orphaned), "documents": len(stored) - len(orphaned)}
+
+@app.post("/admin/partitions/{name}/compact")
+async def compact_partition(name: str, admin: str = Depends(get_admin_user)):
+    """
+    Delete vectors in a partition that no manifest entry references, e.g. left
+    behind by an interrupted embedding run.
+    """
+    return await run_io(compact_partition_store, name)
+
+@app.post("/admin/embeddings/benchmark")
+async def benchmark_embeddings(
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    mode: str = Form("sox"),
+    providers: str = Form(",".join(EMBEDDING_PROVIDERS)),
+    limit: int = Form(500),
+    admin: str = Depends(get_admin_user),
+):
+    """
+    Embed a dataset's documents with each provider (without storing them) and
+    report batch throughput, for comparing the local backend with the remote one.
+    """
+    try:
+        dataset_id, entry = await load_dataset(file, dataset_id)
+        texts = [text for text, _ in build_documents(entry["df"], mode, dataset_id, entry["filename"])][:limit]
+        results = []
+        for provider in [p.strip() for p in providers.split(",") if p.strip()]:
+            embedder = clients.embeddings(provider)
+            started = time.perf_counter()
+            vectors = []
+            for start in range(0, len(texts), EMBED_BATCH_SIZE):
+                vectors.extend(await run_io(embedder.embed_documents, texts[start:start + EMBED_BATCH_SIZE]))
+            elapsed = time.perf_counter() - started
+            results.append({
+                "provider": provider,
+                "documents": len(texts),
+                "dimensions": len(vectors[0]) if vectors else 0,
+                "seconds": round(elapsed, 4),
+                "documents_per_second": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+            })
+        return {"dataset_id": dataset_id, "batch_size": EMBED_BATCH_SIZE, "results": results}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error in embedding benchmark: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/admin/executors")
+async def executor_stats(admin: str = Depends(get_admin_user)):
+    return {name: executor.stats() for name, executor in EXECUTORS.items()}
+
+@app.get("/admin/llm-cache")
+async def llm_cache_stats(admin: str = Depends(get_admin_user)):
+    return llm_cache.stats()
+
+@app.delete("/admin/llm-cache")
+async def clear_llm_cache(admin: str = Depends(get_admin_user)):
+    llm_cache.clear()
+    return {"status": "cleared"}
+
+def drop_partition_store(name: str):
+    with partitions_lock:
+        partitions = load_partitions()
+        if name not in partitions:
+            raise HTTPException(status_code=404, detail="Partition not found")
+        clients.drop_vectorstore(name)
+        del partitions[name]
+        save_partitions(partitions)
+    with embed_manifest_lock:
+        manifest = load_embed_manifest()
+        for source in [s for s in manifest if s.startswith(f"{name}:")]:
+            del manifest[source]
+        save_embed_manifest(manifest)
+    return {"name": name, "status": "dropped"}
+
+@app.delete("/admin/partitions/{name}")
+async def drop_partition(name: str, admin: str = Depends(get_admin_user)):
+    return await run_io(drop_partition_store, name)
+
 @app.post("/detect-anomalies/")
-async def detect_anomalies(file: UploadFile = File(...), mode: str = Form("sox")):
+async def detect_anomalies(
+    background_tasks: BackgroundTasks,
+    file: Optional[UploadFile] = File(None),
+    mode: str = Form("sox"),
+    dataset_id: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    current_user: Optional[str] = Depends(get_optional_user),
+):
     try:
-        ext = file.filename.split('.')[-1].lower()
-        df = pd.read_csv(BytesIO(await file.read())) if ext == "csv" else pd.read_excel(BytesIO(await file.read()))
-        anomalies = detect_anomalies_df(df, mode)
+        if should_stream(file, dataset_id, stream):
+            anomalies, _ = await run_compute(stream_rules, file, mode)
+            return {"anomalies": anomalies or ["No anomalies detected."]}
+        dataset_id, entry = await load_dataset(file, dataset_id)
+        background_tasks.add_task(record_metrics, entry, dataset_id, mode, current_user)
+        anomalies = await run_compute(detect_anomalies_df, entry["df"], mode, entry["views"])
         return {"anomalies": anomalies}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in detect-anomalies for {mode}: {str(e)}")
         return JSONResponse(status_code=500, content={"error": f"Failed to detect anomalies for {mode.upper()} data: {str(e)}"})
 
 @app.post("/detect-alerts/")
-async def detect_alerts(file: UploadFile = File(...), mode: str = Form("sox")):
+async def detect_alerts(file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None), stream: bool = Form(False)):
     try:
-        ext = file.filename.split('.')[-1].lower()
-        df = pd.read_csv(BytesIO(await file.read())) if ext == "csv" else pd.read_excel(BytesIO(await file.read()))
-        df.columns = [c.strip().lower() for c in df.columns]
-
-        alerts = []
-
-        if mode == "sox":
-            # SOX alerts
-            if "risk rating" in df.columns and "result" in df.columns:
-                failed_critical = df[
-                    (df["risk rating"].str.lower().isin(["high", "critical"])) &
-                    (df["result"].str.lower().str.contains("fail"))
-                ]
-                if not failed_critical.empty:
-                    alerts.append("High or critical risk controls have failed results.")
-
-            if "risk rating" in df.columns and "due date" in df.columns:
-                df["due date"] = pd.to_datetime(df["due date"], errors="coerce")
-                overdue = df[
-                    (df["risk rating"].str.lower().isin(["high", "critical"])) &
-                    (df["due date"] < pd.Timestamp.now())
-                ]
-                if not overdue.empty:
-                    alerts.append("High or critical risk controls are overdue.")
-
-            if "owner" in df.columns:
-                missing_owner = df[df["owner"].isnull() | df["owner"].astype(str).str.strip().eq("")]
-                if not missing_owner.empty:
-                    alerts.append("Some controls are missing assigned owners.")
-
-            if "frequency" in df.columns:
-                missing_freq = df[df["frequency"].isnull() | df["frequency"].astype(str).str.strip().eq("")]
-                if not missing_freq.empty:
-                    alerts.append("Some controls do not have a defined test frequency.")
-
-            if "due date" in df.columns:
-                overdue_30 = df[
-                    pd.to_datetime(df["due date"], errors="coerce") <
-                    pd.Timestamp.now() - pd.Timedelta(days=30)
-                ]
-                if not overdue_30.empty:
-                    alerts.append("Some controls are overdue by more than 30 days.")
-
-        elif mode == "esg":
-            # ESG alerts
-            if "esg factor" in df.columns and "status" in df.columns:
-                failed_status = df[
-                    (df["status"].str.lower().str.contains("fail"))
-                ]
-                if not failed_status.empty:
-                    alerts.append(f"{len(failed_status)} ESG metrics have failed status.")
-
-            if "value" in df.columns and "threshold" in df.columns:
-                # Convert to numeric, handling any non-numeric values
-                df_numeric = df.copy()
-                df_numeric["value"] = pd.to_numeric(df_numeric["value"], errors="coerce")
-                df_numeric["threshold"] = pd.to_numeric(df_numeric["threshold"], errors="coerce")
-                
-                below_threshold = df_numeric[
-                    (df_numeric["value"] < df_numeric["threshold"]) & 
-                    (df_numeric["value"].notna()) & 
-                    (df_numeric["threshold"].notna())
-                ]
-                if not below_threshold.empty:
-                    alerts.append(f"{len(below_threshold)} ESG metrics are below threshold.")
-
-            if "owner" in df.columns:
-                missing_owner = df[df["owner"].isnull() | df["owner"].astype(str).str.strip().eq("")]
-                if not missing_owner.empty:
-                    alerts.append("Some ESG metrics are missing assigned owners.")
-
-            if "due date" in df.columns:
-                df["due date"] = pd.to_datetime(df["due date"], errors="coerce")
-                overdue = df[
-                    (df["due date"] < pd.Timestamp.now())
-                ]
-                if not overdue.empty:
-                    alerts.append("Some ESG metrics are overdue.")
-
-            if "due date" in df.columns:
-                overdue_30 = df[
-                    pd.to_datetime(df["due date"], errors="coerce") <
-                    pd.Timestamp.now() - pd.Timedelta(days=30)
-                ]
-                if not overdue_30.empty:
-                    alerts.append("Some ESG metrics are overdue by more than 30 days.")
-
-        elif mode == "soc2":
-            # SOC 2 alerts
-            if "trust service criteria" in df.columns and "status" in df.columns:
-                failed_status = df[
-                    (df["status"].str.lower().str.contains("fail"))
-                ]
-                if not failed_status.empty:
-                    alerts.append(f"{len(failed_status)} SOC 2 controls have failed status.")
-
-            if "last test date" in df.columns:
-                test_dates = pd.to_datetime(df["last test date"], errors="coerce")
-                old_tests = test_dates < (pd.Timestamp.now() - pd.Timedelta(days=90))
-                if old_tests.any():
-                    alerts.append(f"{old_tests.sum()} controls haven't been tested in over 90 days.")
-
-            if "owner" in df.columns:
-                missing_owner = df[df["owner"].isnull() | df["owner"].astype(str).str.strip().eq("")]
-                if not missing_owner.empty:
-                    alerts.append("Some SOC 2 controls are missing assigned owners.")
-
-            if "trust service criteria" in df.columns:
-                # Check for controls covering all TSC categories
-                tsc_categories = ["CC", "DC", "AI", "PR", "SL"]
-                missing_tsc = []
-                for tsc in tsc_categories:
-                    if not df[df["trust service criteria"].str.contains(tsc, na=False, case=False)].empty:
-                        continue
-                    missing_tsc.append(tsc)
-                if missing_tsc:
-                    alerts.append(f"Missing controls for Trust Service Criteria: {', '.join(missing_tsc)}")
-
-            if "control type" in df.columns:
-                missing_controls = df[df["control type"].isnull() | df["control type"].astype(str).str.strip().eq("")]
-                if not missing_controls.empty:
-                    alerts.append(f"{len(missing_controls)} controls have no control type specified.")
-
-        elif mode == "iso27001":
-            # ISO 27001 alerts
-            if "Status" in df.columns:
-                failed = df[df["Status"].str.lower().str.contains("fail|not implemented", na=False)]
-                if not failed.empty:
-                    alerts.append(f"{len(failed)} controls are failed or not implemented.")
-            if "Last Review Date" in df.columns:
-                review_dates = pd.to_datetime(df["Last Review Date"], errors="coerce")
-                overdue = review_dates < (pd.Timestamp.now() - pd.Timedelta(days=365))
-                if overdue.any():
-                    alerts.append(f"{overdue.sum()} controls have not been reviewed in over 12 months.")
-                if review_dates.isna().sum() > 0:
-                    alerts.append(f"{review_dates.isna().sum()} controls have no review date recorded.")
-            if "Evidence" in df.columns:
-                missing_evidence = df[df["Evidence"].isnull() | df["Evidence"].astype(str).str.strip().eq("")]
-                if not missing_evidence.empty:
-                    alerts.append(f"{len(missing_evidence)} controls are missing evidence.")
-            if "Control Owner" in df.columns:
-                missing_owner = df[df["Control Owner"].isnull() | df["Control Owner"].astype(str).str.strip().eq("")]
-                if not missing_owner.empty:
-                    alerts.append(f"{len(missing_owner)} controls are missing assigned owners.")
-            if "Annex A Reference" in df.columns:
-                missing_annex = df[df["Annex A Reference"].isnull() | df["Annex A Reference"].astype(str).str.strip().eq("")]
-                if not missing_annex.empty:
-                    alerts.append(f"{len(missing_annex)} controls are missing Annex A references.")
-            if "Control ID" in df.columns:
-                dupes = df["Control ID"][df["Control ID"].duplicated()]
-                if not dupes.empty:
-                    alerts.append(f"{len(dupes)} controls have duplicate Control IDs.")
+        if should_stream(file, dataset_id, stream):
+            _, alerts = await run_compute(stream_rules, file, mode)
+        else:
+            _, entry = await load_dataset(file, dataset_id)
+            _, alerts = await run_compute(lambda: evaluate_rules(entry["df"], mode, views=entry["views"]))
 
         if alerts:
-            send_slack_alerts(alerts, mode)
+            await run_io(send_slack_alerts, alerts, mode)
 
         return {"alerts": alerts or ["No urgent alerts detected."]}
+    except HTTPException:
+        raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.post("/query/")
-async def query_with_memory(file: UploadFile = File(...), prompt: str = Form(...), mode: str = Form("sox")):
+# --- Streaming ---
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_sse(chunks, on_complete=None):
+    """
+    Relay an async iterator of text chunks as server-sent events: one "token" event
+    per chunk, then a "done" event with the full text and timing, or an "error"
+    event if generation fails. on_complete(text) runs before "done" is sent.
+    """
+    started = time.perf_counter()
+    first_token = None
+    parts = []
     try:
-        vectordb = Chroma(persist_directory=CHROMA_DIR, embedding_function=OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY))
-        retriever = vectordb.as_retriever()
+        async for chunk in chunks:
+            if first_token is None:
+                first_token = time.perf_counter()
+            parts.append(chunk)
+            yield sse_event("token", {"text": chunk})
+        text = "".join(parts)
+        if on_complete:
+            on_complete(text)
+        finished = time.perf_counter()
+        yield sse_event("done", {
+            "response": text,
+            "chunks": len(parts),
+            "time_to_first_token_ms": round((first_token - started) * 1000, 1) if first_token else None,
+            "total_ms": round((finished - started) * 1000, 1),
+        })
+    except Exception as e:
+        print(f"Error while streaming response: {str(e)}")
+        yield sse_event("error", {"error": str(e)})
 
-        mode_context = "SOX compliance and internal controls" if mode == "sox" else "ESG (Environmental, Social, and Governance) compliance" if mode == "esg" else "SOC 2 (System and Organization Controls) compliance"
-        
-        template = f"""
-        You are a helpful {mode_context} assistant. Use the following extracted content to answer the question.
-
-        {{context}}
-
-        Question: {{question}}
-        Answer:"""
-        prompt_template = PromptTemplate.from_template(template)
-        model = OpenAI(openai_api_key=OPENAI_API_KEY)
-        chain = (
-            {"context": retriever, "question": RunnablePassthrough()}
-            | prompt_template
-            | model
-            | StrOutputParser()
-        )
-        result = chain.invoke(prompt)
+def sse_response(events) -> StreamingResponse:
+    # X-Accel-Buffering stops nginx-style proxies from holding back the stream
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def build_query_chain(current_user: Optional[str], mode: str):
+    vectordb = clients.vectorstore(partition_name(current_user, mode))
+    retriever = vectordb.as_retriever()
+
+    mode_context = "SOX compliance and internal controls" if mode == "sox" else "ESG (Environmental, Social, and Governance) compliance" if mode == "esg" else "SOC 2 (System and Organization Controls) compliance"
+    
+    template = f"""
+    You are a helpful {mode_context} assistant. Use the following extracted content to answer the question.
+
+    {{context}}
+
+    Question: {{question}}
+    Answer:"""
+    prompt_template = PromptTemplate.from_template(template)
+    model = clients.llm()
+    return (
+        {"context": retriever, "question": RunnablePassthrough()}
+        | prompt_template
+        | model
+        | StrOutputParser()
+    )
+
+@app.post("/query/")
+async def query_with_memory(file: Optional[UploadFile] = File(None), prompt: str = Form(...), mode: str = Form("sox"), current_user: Optional[str] = Depends(get_optional_user)):
+    try:
+        chain = build_query_chain(current_user, mode)
+        result = await run_io(chain.invoke, prompt)
         return {"response": result}
+    except HTTPException:
+        raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.post("/ask-ai/")
-async def ask_ai(file: UploadFile = File(...), prompt: str = Form(...), generate_pdf: bool = Form(...), mode: str = Form("sox")):
+@app.post("/query/stream")
+async def query_stream(prompt: str = Form(...), mode: str = Form("sox"), current_user: Optional[str] = Depends(get_optional_user)):
+    """Streaming variant of /query/: the answer arrives as server-sent events."""
     try:
-        print(f"Starting ask_ai function for mode: {mode}")
-        file.file.seek(0)
-        path = save_versioned_file(file)
-        ext = path.split('.')[-1].lower()
-        df = pd.read_csv(path) if ext == "csv" else pd.read_excel(path)
-        preview = df.head(30).to_string(index=False)
-
-        mode_context = (
-            "SOX compliance" if mode == "sox" else
-            "ESG compliance" if mode == "esg" else
-            "SOC 2 compliance" if mode == "soc2" else
-            "ISO 27001 Information Security Management"
-        )
-        
-        # Generate default prompt if none provided
-        if not prompt.strip():
-            default_prompt = f"""
-            Provide a comprehensive analysis of this {mode_context} dataset including:
-            1. Overall compliance health and key metrics
-            2. Critical risks and areas of concern
-            3. Patterns and trends in the data
-            4. Recommendations for improvement
-            5. Executive summary for stakeholders
-            
-            Focus on actionable insights and prioritize the most important findings.
-            """
-            prompt = default_prompt
-            print("Using default comprehensive analysis prompt")
-
-        print("Generating AI response...")
-        ai = OpenAI(openai_api_key=OPENAI_API_KEY)
-        response = ai.invoke(f"{prompt}\n\nHere is the preview:\n{preview}")
+        chain = build_query_chain(current_user, mode)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    return sse_response(stream_sse(chain.astream(prompt)))
+
+def ask_ai_context(prompt: str, mode: str):
+    """The framework description for a mode and the prompt to send, defaulting to a full analysis."""
+    mode_context = (
+        "SOX compliance" if mode == "sox" else
+        "ESG compliance" if mode == "esg" else
+        "SOC 2 compliance" if mode == "soc2" else
+        "ISO 27001 Information Security Management"
+    )
+    
+    # Generate default prompt if none provided
+    if not prompt.strip():
+        default_prompt = f"""
+        Provide a comprehensive analysis of this {mode_context} dataset including:
+        1. Overall compliance health and key metrics
+        2. Critical risks and areas of concern
+        3. Patterns and trends in the data
+        4. Recommendations for improvement
+        5. Executive summary for stakeholders
         
-        # Generate additional insights for comprehensive reports
-        recommendations = ai.invoke(f"Based on this {mode_context} data, provide specific, actionable improvement recommendations:\n\n" + preview)
-        conclusion = ai.invoke(f"Summarize the key executive takeaways and what leadership should focus on from this {mode_context} data:\n\n" + preview)
-
-        if not generate_pdf:
-            print("PDF generation disabled, returning response only")
-            return {"response": response}
+        Focus on actionable insights and prioritize the most important findings.
+        """
+        prompt = default_prompt
+        print("Using default comprehensive analysis prompt")
+    return prompt, mode_context
+
+# --- Report artifacts ---
+# Built PDF reports are stored under REPORT_DIR as <report_id>.pdf plus a .json
+# metadata file. The report_id hashes the inputs (dataset, mode, prompt, model), so a
+# stored report answers every later request for the same inputs.
+def report_key(dataset_id: str, mode: str, prompt: str) -> str:
+    ai = clients.llm()
+    model = getattr(ai, "model_name", type(ai).__name__)
+    return hashlib.sha256(json.dumps(["report", dataset_id, mode, prompt, model]).encode()).hexdigest()
+
+def report_paths(report_id: str):
+    return os.path.join(REPORT_DIR, f"{report_id}.pdf"), os.path.join(REPORT_DIR, f"{report_id}.json")
+
+def load_report_meta(report_id: str) -> Optional[dict]:
+    if not re.fullmatch(r"[0-9a-f]{64}", report_id):
+        return None
+    pdf_path, meta_path = report_paths(report_id)
+    if not os.path.exists(meta_path) or not os.path.exists(pdf_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+def save_report(report_id: str, content: bytes, info: dict) -> dict:
+    pdf_path, meta_path = report_paths(report_id)
+    meta = {
+        **info,
+        "size": len(content),
+        "etag": f'"{hashlib.sha256(content).hexdigest()[:32]}"',
+        "created_at": datetime.now().isoformat(),
+    }
+    # The PDF goes first so metadata never points at a missing or partial file
+    for path, data in ((pdf_path, content), (meta_path, json.dumps(meta).encode())):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    collect_report_garbage()
+    return meta
+
+def collect_report_garbage(now=None):
+    cutoff = (now or time.time()) - REPORT_RETENTION_DAYS * 86400
+    for name in os.listdir(REPORT_DIR):
+        path = os.path.join(REPORT_DIR, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+def read_file_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+class ReportJobs:
+    """
+    Builds reports as tasks on the event loop (their blocking stages already run on
+    the executors). Requests for a report that is being built attach to the running
+    task instead of starting another; failures are remembered for JOB_TTL_SECONDS.
+    """
 
-        print("Starting PDF generation...")
-        anomalies = detect_anomalies_df(df, mode)
+    def __init__(self):
+        self._tasks = {}
+        self._failures = {}
+
+    def _prune_failures(self, now: float):
+        for report_id in [r for r, failure in self._failures.items() if now - failure["finished"] > JOB_TTL_SECONDS]:
+            del self._failures[report_id]
+
+    def status(self, report_id: str) -> Optional[dict]:
+        meta = load_report_meta(report_id)
+        if meta is not None:
+            return {"report_id": report_id, "status": "ready", "download_url": f"/reports/{report_id}/download", **meta}
+        if report_id in self._tasks:
+            return {"report_id": report_id, "status": "running"}
+        failure = self._failures.get(report_id)
+        if failure is not None and time.time() - failure["finished"] <= JOB_TTL_SECONDS:
+            return {"report_id": report_id, "status": "failed", "error": failure["error"]}
+        return None
 
-        # Simple PDF Generation without complex charts
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
+    def submit(self, report_id: str, build, **info) -> dict:
+        """Start build() -> bytes unless the report is already stored or being built."""
+        status = self.status(report_id)
+        if status is not None and status["status"] != "failed":
+            return status
+        self._failures.pop(report_id, None)
+        self._prune_failures(time.time())
+        task = asyncio.create_task(self._run(report_id, build, info))
+        self._tasks[report_id] = task
+        return {"report_id": report_id, "status": "running"}
+
+    async def _run(self, report_id: str, build, info):
+        try:
+            content = await build()
+            await run_io(save_report, report_id, content, info)
+        except Exception as e:
+            print(f"Report {report_id} failed: {str(e)}")
+            now = time.time()
+            self._prune_failures(now)
+            self._failures[report_id] = {"error": str(e), "finished": now}
+        finally:
+            self._tasks.pop(report_id, None)
+
+    async def wait(self, report_id: str) -> Optional[dict]:
+        task = self._tasks.get(report_id)
+        if task is not None:
+            # Shield so a disconnecting client does not cancel a build others wait on
+            await asyncio.shield(task)
+        return self.status(report_id)
+
+report_jobs = ReportJobs()
+
+async def build_report_pdf(entry, dataset_id: str, prompt: str, mode: str) -> bytes:
+    """Build the full /ask-ai/ PDF report for a dataset; `prompt` is the already-defaulted analysis prompt."""
+    df = entry["df"]
+    nf = NormalizedFrame(df, views=entry["views"])
+    filename = entry["filename"]
+    preview = df.head(30).to_string(index=False)
+    _, mode_context = ask_ai_context(prompt, mode)
+
+    print("Generating AI response...")
+    # The preview is derived from the dataset, so dataset_id identifies it in the cache
+    analysis_call = ainvoke_llm_cached(f"{prompt}\n\nHere is the preview:\n", mode, dataset_id, preview)
+
+    # Generate additional insights for comprehensive reports. All three calls run
+    # concurrently while the metrics and charts are computed in a worker thread.
+    llm_calls = asyncio.gather(
+        analysis_call,
+        ainvoke_llm_cached(f"Based on this {mode_context} data, provide specific, actionable improvement recommendations:\n\n", mode, dataset_id, preview),
+        ainvoke_llm_cached(f"Summarize the key executive takeaways and what leadership should focus on from this {mode_context} data:\n\n", mode, dataset_id, preview),
+    )
 
-        # Title Page
-        elements.append(Paragraph(f"CompLite {mode.upper()} Compliance Report", styles["Title"]))
-        elements.append(Spacer(1, 20))
-        elements.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}", styles["Normal"]))
-        elements.append(Paragraph(f"Dataset: {file.filename}", styles["Normal"]))
-        elements.append(PageBreak())
+    def aggregate():
+        anomalies = detect_anomalies_df(df, mode, entry["views"])
+        summary = compliance_summary(nf, mode)
+        series = chart_series(df, mode, summary["compliance_score"], summary["failed_pct"], summary["overdue_pct"], summary["missing_owner_pct"], nf)
+        return anomalies, summary, series, critical_issues(nf, mode)
 
-        # Executive Summary
-        elements.append(Paragraph("Executive Summary", styles["Heading1"]))
-        
-        # Calculate key metrics
-        total_items = len(df)
-        if mode == "sox":
-            failed_count = len(df[df["Result"].str.lower().str.contains("fail", na=False)]) if "Result" in df.columns else 0
-            overdue_count = len(df[pd.to_datetime(df["Due Date"], errors="coerce") < pd.Timestamp.now()]) if "Due Date" in df.columns else 0
-            missing_owner = len(df[df["Owner"].isnull() | df["Owner"].astype(str).str.strip().eq("")]) if "Owner" in df.columns else 0
-        elif mode == "esg":
-            failed_count = len(df[df["Status"].str.lower().str.contains("fail", na=False)]) if "Status" in df.columns else 0
-            overdue_count = len(df[pd.to_datetime(df["Due Date"], errors="coerce") < pd.Timestamp.now()]) if "Due Date" in df.columns else 0
-            missing_owner = len(df[df["Owner"].isnull() | df["Owner"].astype(str).str.strip().eq("")]) if "Owner" in df.columns else 0
-        elif mode == "soc2":
-            failed_count = len(df[df["Status"].str.lower().str.contains("fail", na=False)]) if "Status" in df.columns else 0
-            overdue_count = len(df[pd.to_datetime(df["Last Test Date"], errors="coerce") < (pd.Timestamp.now() - pd.Timedelta(days=90))]) if "Last Test Date" in df.columns else 0
-            missing_owner = len(df[df["Owner"].isnull() | df["Owner"].astype(str).str.strip().eq("")]) if "Owner" in df.columns else 0
-        else:  # iso27001
-            failed_count = len(df[df["Status"].str.lower().str.contains("fail|not implemented", na=False)]) if "Status" in df.columns else 0
-            overdue_count = len(df[pd.to_datetime(df["Last Review Date"], errors="coerce") < (pd.Timestamp.now() - pd.Timedelta(days=365))]) if "Last Review Date" in df.columns else 0
-            missing_owner = len(df[df["Control Owner"].isnull() | df["Control Owner"].astype(str).str.strip().eq("")]) if "Control Owner" in df.columns else 0
-            missing_evidence = len(df[df["Evidence"].isnull() | df["Evidence"].astype(str).str.strip().eq("")]) if "Evidence" in df.columns else 0
-            missing_annex = len(df[df["Annex A Reference"].isnull() | df["Annex A Reference"].astype(str).str.strip().eq("")]) if "Annex A Reference" in df.columns else 0
-
-        failed_pct = (failed_count / total_items * 100) if total_items > 0 else 0
-        overdue_pct = (overdue_count / total_items * 100) if total_items > 0 else 0
-        missing_owner_pct = (missing_owner / total_items * 100) if total_items > 0 else 0
-
-        # Calculate compliance score
-        if mode == "iso27001":
-            compliance_score = max(0, 100 - failed_pct - overdue_pct - missing_owner_pct - (missing_evidence / total_items * 100 if total_items > 0 else 0) - (missing_annex / total_items * 100 if total_items > 0 else 0))
-        else:
-            compliance_score = max(0, 100 - failed_pct - overdue_pct - missing_owner_pct)
+    async def prepare_report():
+        anomalies, summary, series, issues = await run_compute(aggregate)
+        print("Generating charts...")
+        return anomalies, summary, await create_compliance_charts(series), issues
 
-        # Key Metrics Table
-        elements.append(Paragraph("Key Compliance Metrics", styles["Heading2"]))
+    try:
+        report, (response, recommendations, conclusion) = await asyncio.gather(prepare_report(), llm_calls)
+    except Exception:
+        llm_calls.cancel()
+        raise
+    anomalies, counts, charts, unique_controls = report
+    failed_pct, overdue_pct, missing_owner_pct = counts["failed_pct"], counts["overdue_pct"], counts["missing_owner_pct"]
+    compliance_score = counts["compliance_score"]
+
+    print("Starting PDF generation...")
+
+    # Simple PDF Generation without complex charts
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = []
+
+    # Title Page
+    elements.append(Paragraph(f"CompLite {mode.upper()} Compliance Report", styles["Title"]))
+    elements.append(Spacer(1, 20))
+    elements.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}", styles["Normal"]))
+    elements.append(Paragraph(f"Dataset: {filename}", styles["Normal"]))
+    elements.append(PageBreak())
+
+    # Executive Summary
+    elements.append(Paragraph("Executive Summary", styles["Heading1"]))
+    
+    # Key metrics
+    total_items = counts["total"]
+    failed_count = counts["failed"]
+    overdue_count = counts["overdue"]
+    missing_owner = counts["missing_owner"]
+    missing_evidence = counts["missing_evidence"]
+    missing_annex = counts["missing_annex"]
+
+    # Key Metrics Table
+    elements.append(Paragraph("Key Compliance Metrics", styles["Heading2"]))
+    
+    metrics_data = [
+        ["Metric", "Count", "Percentage"],
+        ["Total Items", str(total_items), "100%"],
+        ["Failed/Not Implemented", str(failed_count), f"{failed_pct:.1f}%"],
+        ["Overdue Items", str(overdue_count), f"{overdue_pct:.1f}%"],
+        ["Missing Owners", str(missing_owner), f"{missing_owner_pct:.1f}%"],
+        ["Overall Compliance Score", f"{compliance_score:.1f}%", ""]
+    ]
+    
+    if mode == "iso27001":
+        metrics_data.insert(4, ["Missing Evidence", str(missing_evidence), f"{(missing_evidence / total_items * 100) if total_items > 0 else 0:.1f}%"])
+        metrics_data.insert(5, ["Missing Annex A References", str(missing_annex), f"{(missing_annex / total_items * 100) if total_items > 0 else 0:.1f}%"])
+    
+    metrics_table = Table(metrics_data)
+    metrics_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(metrics_table)
+    elements.append(Spacer(1, 20))
+
+    # AI Analysis
+    elements.append(Paragraph("AI Analysis", styles["Heading2"]))
+    elements.append(Paragraph(response, styles["Normal"]))
+    elements.append(PageBreak())
+
+    # Add charts
+    if charts:
+        elements.append(Paragraph("Visual Analytics", styles["Heading1"]))
         
-        metrics_data = [
-            ["Metric", "Count", "Percentage"],
-            ["Total Items", str(total_items), "100%"],
-            ["Failed/Not Implemented", str(failed_count), f"{failed_pct:.1f}%"],
-            ["Overdue Items", str(overdue_count), f"{overdue_pct:.1f}%"],
-            ["Missing Owners", str(missing_owner), f"{missing_owner_pct:.1f}%"],
-            ["Overall Compliance Score", f"{compliance_score:.1f}%", ""]
-        ]
+        for chart_name, chart_buffer in charts:
+            elements.append(Paragraph(CHART_TITLES[chart_name], styles["Heading2"]))
+            elements.append(Spacer(1, 12))
+            elements.append(chart_flowable(chart_buffer, 450, 250))
+            elements.append(Spacer(1, 12))
         
-        if mode == "iso27001":
-            metrics_data.insert(4, ["Missing Evidence", str(missing_evidence), f"{(missing_evidence / total_items * 100) if total_items > 0 else 0:.1f}%"])
-            metrics_data.insert(5, ["Missing Annex A References", str(missing_annex), f"{(missing_annex / total_items * 100) if total_items > 0 else 0:.1f}%"])
+        elements.append(PageBreak())
+
+    # Top Issues Section
+    elements.append(Paragraph("Critical Issues Requiring Attention", styles["Heading1"]))
+    
+    # Create issues table
+    if unique_controls:
+        issues_data = [["Issue", "Type", "Risk Level", "Owner", "Status"]]
+        for control in unique_controls:
+            issues_data.append([
+                control['name'][:50] + "..." if len(control['name']) > 50 else control['name'],
+                control['type'],
+                control['risk'],
+                control['owner'],
+                control['status']
+            ])
         
-        metrics_table = Table(metrics_data)
-        metrics_table.setStyle(TableStyle([
+        issues_table = Table(issues_data)
+        issues_table.setStyle(TableStyle([
             ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
             ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
             ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
             ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTSIZE', (0, 1), (-1, -1), 8)
         ]))
-        elements.append(metrics_table)
-        elements.append(Spacer(1, 20))
-
-        # AI Analysis
-        elements.append(Paragraph("AI Analysis", styles["Heading2"]))
-        elements.append(Paragraph(response, styles["Normal"]))
-        elements.append(PageBreak())
-
-        # Generate and add charts
-        print("Generating charts...")
-        charts = create_compliance_charts(df, mode, compliance_score, failed_pct, overdue_pct, missing_owner_pct)
-        
-        if charts:
-            elements.append(Paragraph("Visual Analytics", styles["Heading1"]))
-            
-            for chart_name, chart_buffer in charts:
-                if chart_name == 'compliance_score':
-                    elements.append(Paragraph("Compliance Score Breakdown", styles["Heading2"]))
-                elif chart_name == 'risk_distribution':
-                    elements.append(Paragraph("Risk Rating Distribution", styles["Heading2"]))
-                elif chart_name == 'owner_performance':
-                    elements.append(Paragraph("Control Distribution by Owner", styles["Heading2"]))
-                elif chart_name == 'trend_analysis':
-                    elements.append(Paragraph("Overdue Items Trend Analysis", styles["Heading2"]))
-                
-                elements.append(Spacer(1, 12))
-                
-                # Convert chart to ReportLab image
-                from reportlab.platypus import Image
-                chart_img = Image(chart_buffer)
-                chart_img.drawHeight = 250
-                chart_img.drawWidth = 450
-                elements.append(chart_img)
-                elements.append(Spacer(1, 12))
-            
-            elements.append(PageBreak())
-
-        # Top Issues Section
-        elements.append(Paragraph("Critical Issues Requiring Attention", styles["Heading1"]))
-        
-        # Identify problematic controls
-        problematic_controls = []
-        
-        if mode == "sox":
-            desc_col = "Control Description" if "Control Description" in df.columns else "Description"
-            risk_col = "Risk Rating"
-            status_col = "Result"
-            
-            # High risk controls
-            high_risk = df[df[risk_col].str.lower().str.contains("high", na=False)]
-            for _, control in high_risk.iterrows():
-                problematic_controls.append({
-                    'name': control.get(desc_col, 'Unnamed Control'),
-                    'risk': control.get(risk_col, 'Unknown'),
-                    'owner': control.get('Owner', 'Unknown'),
-                    'status': control.get(status_col, 'Unknown'),
-                    'type': 'High Risk'
-                })
-            
-            # Failed controls
-            failed = df[df[status_col].str.lower().str.contains("fail", na=False)]
-            for _, control in failed.iterrows():
-                problematic_controls.append({
-                    'name': control.get(desc_col, 'Unnamed Control'),
-                    'risk': control.get(risk_col, 'Unknown'),
-                    'owner': control.get('Owner', 'Unknown'),
-                    'status': control.get(status_col, 'Unknown'),
-                    'type': 'Failed'
-                })
-                
-        elif mode == "esg":
-            desc_col = "Metric" if "Metric" in df.columns else "Description"
-            risk_col = "ESG Factor"
-            status_col = "Status"
-            
-            # Failed ESG metrics
-            failed = df[df[status_col].str.lower().str.contains("fail", na=False)]
-            for _, control in failed.iterrows():
-                problematic_controls.append({
-                    'name': control.get(desc_col, 'Unnamed Metric'),
-                    'risk': control.get(risk_col, 'Unknown'),
-                    'owner': control.get('Owner', 'Unknown'),
-                    'status': control.get(status_col, 'Unknown'),
-                    'type': 'Failed'
-                })
-                
-        elif mode == "soc2":
-            desc_col = "Control Description" if "Control Description" in df.columns else "Description"
-            risk_col = "Trust Service Criteria"
-            status_col = "Status"
-            
-            # Failed SOC 2 controls
-            failed = df[df[status_col].str.lower().str.contains("fail", na=False)]
-            for _, control in failed.iterrows():
-                problematic_controls.append({
-                    'name': control.get(desc_col, 'Unnamed Control'),
-                    'risk': control.get(risk_col, 'Unknown'),
-                    'owner': control.get('Owner', 'Unknown'),
-                    'status': control.get(status_col, 'Unknown'),
-                    'type': 'Failed'
-                })
-                
-        else:  # iso27001
-            desc_col = "Control Description" if "Control Description" in df.columns else "Description"
-            risk_col = "Status"
-            status_col = "Status"
-            
-            # Failed ISO 27001 controls
-            failed = df[df[status_col].str.lower().str.contains("fail|not implemented", na=False)]
-            for _, control in failed.iterrows():
-                problematic_controls.append({
-                    'name': control.get(desc_col, 'Unnamed Control'),
-                    'risk': control.get(risk_col, 'Unknown'),
-                    'owner': control.get('Control Owner', 'Unknown'),
-                    'status': control.get(status_col, 'Unknown'),
-                    'type': 'Failed'
-                })
-
-        # Add overdue controls
-        if "Due Date" in df.columns:
-            overdue = df[pd.to_datetime(df["Due Date"], errors="coerce") < pd.Timestamp.now()]
-            for _, control in overdue.iterrows():
-                problematic_controls.append({
-                    'name': control.get(desc_col, 'Unnamed Control'),
-                    'risk': control.get(risk_col, 'Unknown'),
-                    'owner': control.get('Owner', 'Unknown'),
-                    'status': control.get(status_col, 'Unknown'),
-                    'type': 'Overdue'
-                })
-
-        # Remove duplicates and limit to top 10
-        unique_controls = []
-        seen_names = set()
-        for control in problematic_controls:
-            if control['name'] not in seen_names and len(unique_controls) < 10:
-                unique_controls.append(control)
-                seen_names.add(control['name'])
-
-        # Create issues table
-        if unique_controls:
-            issues_data = [["Issue", "Type", "Risk Level", "Owner", "Status"]]
-            for control in unique_controls:
-                issues_data.append([
-                    control['name'][:50] + "..." if len(control['name']) > 50 else control['name'],
-                    control['type'],
-                    control['risk'],
-                    control['owner'],
-                    control['status']
-                ])
-            
-            issues_table = Table(issues_data)
-            issues_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTSIZE', (0, 1), (-1, -1), 8)
-            ]))
-            elements.append(issues_table)
-        else:
-            elements.append(Paragraph("No critical issues identified.", styles["Normal"]))
-        
-        elements.append(PageBreak())
-
-        # AI Recommendations
-        elements.append(Paragraph("AI Recommendations", styles["Heading1"]))
-        elements.append(Paragraph(recommendations, styles["Normal"]))
+        elements.append(issues_table)
+    else:
+        elements.append(Paragraph("No critical issues identified.", styles["Normal"]))
+    
+    elements.append(PageBreak())
+
+    # AI Recommendations
+    elements.append(Paragraph("AI Recommendations", styles["Heading1"]))
+    elements.append(Paragraph(recommendations, styles["Normal"]))
+    elements.append(PageBreak())
+
+    # Anomaly Detection
+    if anomalies:
+        elements.append(Paragraph("Anomaly Detection", styles["Heading1"]))
+        for a in anomalies:
+            elements.append(Paragraph(f"• {a}", styles["Normal"]))
         elements.append(PageBreak())
 
-        # Anomaly Detection
-        if anomalies:
-            elements.append(Paragraph("Anomaly Detection", styles["Heading1"]))
-            for a in anomalies:
-                elements.append(Paragraph(f"• {a}", styles["Normal"]))
-            elements.append(PageBreak())
+    # Conclusion
+    elements.append(Paragraph("Executive Conclusion", styles["Heading1"]))
+    elements.append(Paragraph(conclusion, styles["Normal"]))
 
-        # Conclusion
-        elements.append(Paragraph("Executive Conclusion", styles["Heading1"]))
-        elements.append(Paragraph(conclusion, styles["Normal"]))
+    print("Building PDF document...")
+    await run_compute(doc.build, elements)
+    buffer.seek(0)
+    print("PDF generation completed successfully")
+    print(f"PDF buffer size: {len(buffer.getvalue())} bytes")
+    return buffer.getvalue()
 
-        print("Building PDF document...")
-        doc.build(elements)
-        buffer.seek(0)
-        print("PDF generation completed successfully")
-        print(f"PDF buffer size: {len(buffer.getvalue())} bytes")
-        print(f"Returning StreamingResponse for PDF download")
-        return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={mode}_compliance_report.pdf"})
+@app.post("/ask-ai/")
+async def ask_ai(file: Optional[UploadFile] = File(None), prompt: str = Form(...), generate_pdf: bool = Form(...), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None)):
+    try:
+        print(f"Starting ask_ai function for mode: {mode}")
+        dataset_id, entry = await load_dataset(file, dataset_id, store=True)
+        df = entry["df"]
+        filename = entry["filename"]
+        preview = df.head(30).to_string(index=False)
+        prompt, mode_context = ask_ai_context(prompt, mode)
 
+        if not generate_pdf:
+            print("Generating AI response...")
+            print("PDF generation disabled, returning response only")
+            # The preview is derived from the dataset, so dataset_id identifies it in the cache
+            return {"response": await ainvoke_llm_cached(f"{prompt}\n\nHere is the preview:\n", mode, dataset_id, preview)}
+
+        # Identical requests share one build, and later ones reuse the stored artifact
+        report_id = report_key(dataset_id, mode, prompt)
+        status = report_jobs.submit(report_id, lambda: build_report_pdf(entry, dataset_id, prompt, mode), mode=mode, dataset_id=dataset_id, filename=filename)
+        if status["status"] != "ready":
+            status = await report_jobs.wait(report_id)
+        if status["status"] != "ready":
+            raise Exception(status["error"])
+        print(f"Returning PDF report {report_id}")
+        pdf_path, _ = report_paths(report_id)
+        content = await run_io(read_file_range, pdf_path, 0, status["size"] - 1)
+        return Response(content, media_type="application/pdf", headers={
+            "Content-Disposition": f"attachment; filename={mode}_compliance_report.pdf",
+            "ETag": status["etag"],
+        })
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in ask_ai: {str(e)}")
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/reports", status_code=202)
+async def create_report(file: Optional[UploadFile] = File(None), prompt: str = Form(""), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None)):
+    """
+    Start building the /ask-ai/ PDF report in the background and return its ID.
+    Poll GET /reports/{id}; once ready, download it from GET /reports/{id}/download.
+    """
+    try:
+        dataset_id, entry = await load_dataset(file, dataset_id, store=True)
+        prompt, _ = ask_ai_context(prompt, mode)
+        report_id = report_key(dataset_id, mode, prompt)
+        status = report_jobs.submit(report_id, lambda: build_report_pdf(entry, dataset_id, prompt, mode), mode=mode, dataset_id=dataset_id, filename=entry["filename"])
+        if status["status"] == "ready":
+            return JSONResponse(status_code=200, content=status)
+        return status
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error creating report: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/reports/{report_id}")
+async def get_report(report_id: str):
+    status = report_jobs.status(report_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return status
+
+@app.get("/reports/{report_id}/download")
+async def download_report(report_id: str, request: Request):
+    """Serve a stored report with ETag revalidation and single-range requests."""
+    meta = load_report_meta(report_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Report not ready or not found")
+    pdf_path, _ = report_paths(report_id)
+    size, etag = meta["size"], meta["etag"]
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+        "Content-Disposition": f"attachment; filename={meta.get('mode', 'compliance')}_compliance_report.pdf",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    start, end = 0, size - 1
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # Multiple ranges and malformed headers fall back to the full file
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip()) if range_header else None
+    if match and (match.group(1) or match.group(2)) and (if_range is None or if_range.strip() == etag):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start = max(0, size - int(match.group(2)))
+        if start >= size or start > end:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        content = await run_io(read_file_range, pdf_path, start, end)
+        return Response(content, status_code=206, media_type="application/pdf", headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"})
+
+    content = await run_io(read_file_range, pdf_path, start, end)
+    return Response(content, media_type="application/pdf", headers=headers)
+
+@app.post("/ask-ai/stream")
+async def ask_ai_stream(file: Optional[UploadFile] = File(None), prompt: str = Form(""), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None)):
+    """
+    Streaming variant of /ask-ai/ without a PDF: the analysis arrives as
+    server-sent events. Cached answers are sent as a single token event.
+    """
+    try:
+        dataset_id, entry = await load_dataset(file, dataset_id, store=True)
+        preview = entry["df"].head(30).to_string(index=False)
+        prompt, _ = ask_ai_context(prompt, mode)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in ask_ai stream: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    template = f"{prompt}\n\nHere is the preview:\n"
+    generated = {}
+
+    # Client and cache lookups happen inside the stream, so their failures arrive as an "error" event
+    async def chunks():
+        ai = clients.llm()
+        key = _llm_cache_key(ai, template, mode, dataset_id)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        generated["key"] = key
+        async for chunk in ai.astream(template + preview):
+            yield chunk
+
+    def on_complete(text):
+        if "key" in generated:
+            llm_cache.put(generated["key"], text)
+
+    return sse_response(stream_sse(chunks(), on_complete))
+
 @app.post("/generate-evidence/")
-async def generate_evidence(mode: str = Form("sox")):
+async def generate_evidence(mode: str = Form("sox"), current_user: Optional[str] = Depends(get_optional_user)):
     try:
-        vectordb = Chroma(persist_directory=CHROMA_DIR, embedding_function=OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY))
+        vectordb = clients.vectorstore(partition_name(current_user, mode))
         retriever = vectordb.as_retriever()
         
         if mode == "sox":
@@ -885,12 +1781,14 @@ async def generate_evidence(mode: str = Form("sox")):
         else:  # iso27001
             query = "Show me all ISO 27001 controls with failed status and missing Annex A references."
             
-        docs = retriever.get_relevant_documents(query)
+        docs = await run_io(retriever.get_relevant_documents, query)
         text = "\n---\n".join([doc.page_content for doc in docs])
 
         mode_context = "SOX control" if mode == "sox" else "ESG compliance" if mode == "esg" else "SOC 2 control" if mode == "soc2" else "ISO 27001 control"
-        ai = OpenAI(openai_api_key=OPENAI_API_KEY)
-        summary = ai.invoke(f"Summarize the following {mode_context} data into an audit evidence package:\n{text}")
+        summary = await ainvoke_llm_cached(
+            f"Summarize the following {mode_context} data into an audit evidence package:\n",
+            mode, hashlib.sha256(text.encode()).hexdigest(), text,
+        )
 
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=letter)
@@ -898,10 +1796,12 @@ async def generate_evidence(mode: str = Form("sox")):
         elements = [Paragraph(f"{mode.upper()} Audit Evidence Package", styles["Title"]),
                     Spacer(1, 12),
                     Paragraph(summary, styles["Normal"])]
-        doc.build(elements)
+        await run_compute(doc.build, elements)
         buffer.seek(0)
 
         return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={mode}_evidence.pdf"})
+    except HTTPException:
+        raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
     
@@ -925,366 +1825,472 @@ async def send_slack_alert(payload: dict):
     data = {"text": message}
 
     try:
-        response = requests.post(webhook_url, json=data)
+        response = await run_io(lambda: requests.post(webhook_url, json=data))
         if response.status_code != 200:
             raise Exception(f"Slack returned status {response.status_code}")
         return {"status": "sent"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+def build_rollup(entry, mode, nf=None):
+    """The trend cube for a dataset: failed/overdue/total counts by date bucket, owner and risk rating."""
+    df = entry["df"]
+    nf = nf or NormalizedFrame(df, views=entry["views"])
+    spec = FRAMEWORK_COLUMNS[mode]
+    if spec["date"] not in df.columns:
+        return None
+    masks = compliance_masks(nf, mode)
+    failed = masks["failed"] if masks["failed"] is not None else pd.Series(False, index=df.index)
+    owners = df[spec["owner"]].to_numpy(dtype=object) if spec["owner"] in df.columns else None
+    risks = df["Risk Rating"].to_numpy(dtype=object) if "Risk Rating" in df.columns else None
+    return RollupCube(
+        nf.dates(spec["date"]).to_numpy(),
+        owners,
+        risks,
+        failed.to_numpy(dtype=bool),
+        masks["overdue"].to_numpy(dtype=bool),
+    )
+
+def compute_trends(entry, mode, granularity="month", owner=None, risk=None, nf=None):
+    """Trend counts answered from the dataset's rollup cube; returns (trends, series)."""
+    if mode not in FRAMEWORK_COLUMNS:
+        return {}, []
+    cube = dataset_aggregate(entry, ("rollup", mode), lambda: build_rollup(entry, mode, nf))
+    if cube is None:
+        return {}, []
+    series = cube.query(granularity, owner, risk)
+    trends = {f"overdue_by_{granularity}": {b["period"]: b["overdue"] for b in series if b["overdue"]}}
+    if FRAMEWORK_COLUMNS[mode]["status"] in entry["df"].columns:
+        trends[f"fail_by_{granularity}"] = {b["period"]: b["failed"] for b in series if b["failed"]}
+    return trends, series
+
 @app.post("/analytics/trends/")
-async def analytics_trends(file: UploadFile = File(...), mode: str = Form("sox")):
-    """
-    Returns time-series trends for pass/fail, overdue, missing evidence, etc. for the selected module.
-    """
-    ext = file.filename.split('.')[-1].lower()
-    df = pd.read_csv(BytesIO(await file.read())) if ext == "csv" else pd.read_excel(BytesIO(await file.read()))
-    trends = {}
-    if mode == "sox":
-        if "Due Date" in df.columns:
-            df["Due Date"] = pd.to_datetime(df["Due Date"], errors="coerce")
-            df["Due Month"] = df["Due Date"].dt.to_period('M')
-            overdue_by_month = df[df["Due Date"] < pd.Timestamp.now()].groupby("Due Month").size().to_dict()
-            trends["overdue_by_month"] = {str(k): v for k, v in overdue_by_month.items()}
-        if "Result" in df.columns and "Due Date" in df.columns:
-            df["Due Date"] = pd.to_datetime(df["Due Date"], errors="coerce")
-            df["Due Month"] = df["Due Date"].dt.to_period('M')
-            fail_by_month = df[df["Result"].str.lower().str.contains("fail", na=False)].groupby("Due Month").size().to_dict()
-            trends["fail_by_month"] = {str(k): v for k, v in fail_by_month.items()}
-    elif mode == "esg":
-        if "Due Date" in df.columns:
-            df["Due Date"] = pd.to_datetime(df["Due Date"], errors="coerce")
-            df["Due Month"] = df["Due Date"].dt.to_period('M')
-            overdue_by_month = df[df["Due Date"] < pd.Timestamp.now()].groupby("Due Month").size().to_dict()
-            trends["overdue_by_month"] = {str(k): v for k, v in overdue_by_month.items()}
-        if "Status" in df.columns and "Due Date" in df.columns:
-            df["Due Date"] = pd.to_datetime(df["Due Date"], errors="coerce")
-            df["Due Month"] = df["Due Date"].dt.to_period('M')
-            fail_by_month = df[df["Status"].str.lower().str.contains("fail", na=False)].groupby("Due Month").size().to_dict()
-            trends["fail_by_month"] = {str(k): v for k, v in fail_by_month.items()}
-    elif mode == "soc2":
-        if "Last Test Date" in df.columns:
-            df["Last Test Date"] = pd.to_datetime(df["Last Test Date"], errors="coerce")
-            df["Test Month"] = df["Last Test Date"].dt.to_period('M')
-            overdue_by_month = df[df["Last Test Date"] < (pd.Timestamp.now() - pd.Timedelta(days=90))].groupby("Test Month").size().to_dict()
-            trends["overdue_by_month"] = {str(k): v for k, v in overdue_by_month.items()}
-        if "Status" in df.columns and "Last Test Date" in df.columns:
-            df["Last Test Date"] = pd.to_datetime(df["Last Test Date"], errors="coerce")
-            df["Test Month"] = df["Last Test Date"].dt.to_period('M')
-            fail_by_month = df[df["Status"].str.lower().str.contains("fail", na=False)].groupby("Test Month").size().to_dict()
-            trends["fail_by_month"] = {str(k): v for k, v in fail_by_month.items()}
-    elif mode == "iso27001":
-        if "Last Review Date" in df.columns:
-            df["Last Review Date"] = pd.to_datetime(df["Last Review Date"], errors="coerce")
-            df["Review Month"] = df["Last Review Date"].dt.to_period('M')
-            overdue_by_month = df[df["Last Review Date"] < (pd.Timestamp.now() - pd.Timedelta(days=365))].groupby("Review Month").size().to_dict()
-            trends["overdue_by_month"] = {str(k): v for k, v in overdue_by_month.items()}
-        if "Status" in df.columns and "Last Review Date" in df.columns:
-            df["Last Review Date"] = pd.to_datetime(df["Last Review Date"], errors="coerce")
-            df["Review Month"] = df["Last Review Date"].dt.to_period('M')
-            fail_by_month = df[df["Status"].str.lower().str.contains("fail|not implemented", na=False)].groupby("Review Month").size().to_dict()
-            trends["fail_by_month"] = {str(k): v for k, v in fail_by_month.items()}
-    return {"trends": trends}
+async def analytics_trends(
+    file: Optional[UploadFile] = File(None),
+    mode: str = Form("sox"),
+    dataset_id: Optional[str] = Form(None),
+    granularity: str = Form("month"),
+    owner: Optional[str] = Form(None),
+    risk: Optional[str] = Form(None),
+):
+    """
+    Returns time-series trends for pass/fail, overdue, missing evidence, etc. for the selected module,
+    by day, week, month or quarter, optionally for one owner and/or risk rating.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    _, entry = await load_dataset(file, dataset_id)
+    trends, series = await run_compute(compute_trends, entry, mode, granularity, owner, risk)
+    return {"trends": trends, "granularity": granularity, "series": series}
+
+OWNER_SORT_KEYS = ("owner", "total", "failed", "overdue", "failure_rate", "median_days_overdue", "p90_days_overdue")
+
+def compute_owner_performance(entry, mode, sort="owner", order="asc", limit=None, offset=0, nf=None):
+    """One page of per-owner stats, ordered by `sort` with ties broken by owner; returns (page, owner count)."""
+    stats = owner_performance(nf or NormalizedFrame(entry["df"], views=entry["views"]), mode)
+    if stats is None:
+        return {}, 0
+    stats = stats.rename_axis("owner").reset_index()
+    by, ascending = ["owner"], [order == "asc"]
+    if sort != "owner":
+        by, ascending = [sort, "owner"], [order == "asc", True]
+    stats = stats.sort_values(by, ascending=ascending, na_position="last")
+    page = stats.iloc[offset:offset + limit if limit is not None else None]
+    owner_stats = {}
+    for row in page.itertuples(index=False):
+        owner_stats[row.owner] = {
+            "total": int(row.total),
+            "failed": int(row.failed),
+            "overdue": int(row.overdue),
+            "failure_rate": round(float(row.failure_rate), 4),
+            "median_days_overdue": None if pd.isna(row.median_days_overdue) else float(row.median_days_overdue),
+            "p90_days_overdue": None if pd.isna(row.p90_days_overdue) else float(row.p90_days_overdue),
+        }
+    return owner_stats, len(stats)
 
 @app.post("/analytics/owner-performance/")
-async def analytics_owner_performance(file: UploadFile = File(...), mode: str = Form("sox")):
+async def analytics_owner_performance(
+    file: Optional[UploadFile] = File(None),
+    mode: str = Form("sox"),
+    dataset_id: Optional[str] = Form(None),
+    sort: str = Form("owner"),
+    order: str = Form("asc"),
+    limit: Optional[int] = Form(None),
+    offset: int = Form(0),
+):
     """
-    Returns aggregated stats per owner for the selected module.
+    Returns aggregated stats per owner for the selected module, sorted by `sort`
+    (asc or desc) and paginated with `limit`/`offset`; all owners by default.
     """
-    ext = file.filename.split('.')[-1].lower()
-    df = pd.read_csv(BytesIO(await file.read())) if ext == "csv" else pd.read_excel(BytesIO(await file.read()))
-    owner_stats = {}
-    if mode == "sox":
-        if "Owner" in df.columns and "Result" in df.columns:
-            for owner, group in df.groupby("Owner"):
-                total = len(group)
-                failed = group["Result"].str.lower().str.contains("fail", na=False).sum()
-                overdue = 0
-                if "Due Date" in group.columns:
-                    due_dates = pd.to_datetime(group["Due Date"], errors="coerce")
-                    overdue = (due_dates < pd.Timestamp.now()).sum()
-                owner_stats[owner] = {"total": total, "failed": int(failed), "overdue": int(overdue)}
-    elif mode == "esg":
-        if "Owner" in df.columns and "Status" in df.columns:
-            for owner, group in df.groupby("Owner"):
-                total = len(group)
-                failed = group["Status"].str.lower().str.contains("fail", na=False).sum()
-                overdue = 0
-                if "Due Date" in group.columns:
-                    due_dates = pd.to_datetime(group["Due Date"], errors="coerce")
-                    overdue = (due_dates < pd.Timestamp.now()).sum()
-                owner_stats[owner] = {"total": total, "failed": int(failed), "overdue": int(overdue)}
-    elif mode == "soc2":
-        if "Owner" in df.columns and "Status" in df.columns:
-            for owner, group in df.groupby("Owner"):
-                total = len(group)
-                failed = group["Status"].str.lower().str.contains("fail", na=False).sum()
-                overdue = 0
-                if "Last Test Date" in group.columns:
-                    test_dates = pd.to_datetime(group["Last Test Date"], errors="coerce")
-                    overdue = (test_dates < (pd.Timestamp.now() - pd.Timedelta(days=90))).sum()
-                owner_stats[owner] = {"total": total, "failed": int(failed), "overdue": int(overdue)}
-    elif mode == "iso27001":
-        if "Control Owner" in df.columns and "Status" in df.columns:
-            for owner, group in df.groupby("Control Owner"):
-                total = len(group)
-                failed = group["Status"].str.lower().str.contains("fail|not implemented", na=False).sum()
-                overdue = 0
-                if "Last Review Date" in group.columns:
-                    review_dates = pd.to_datetime(group["Last Review Date"], errors="coerce")
-                    overdue = (review_dates < (pd.Timestamp.now() - pd.Timedelta(days=365))).sum()
-                owner_stats[owner] = {"total": total, "failed": int(failed), "overdue": int(overdue)}
-    return {"owner_performance": owner_stats}
+    if sort not in OWNER_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(OWNER_SORT_KEYS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if (limit is not None and limit < 1) or offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be positive and offset non-negative")
+    _, entry = await load_dataset(file, dataset_id)
+    owner_stats, total_owners = await run_compute(compute_owner_performance, entry, mode, sort, order, limit, offset)
+    return {"owner_performance": owner_stats, "total_owners": total_owners, "offset": offset, "limit": limit}
+
+def compute_critical_issues(entry, mode, limit):
+    return critical_issues(NormalizedFrame(entry["df"], views=entry["views"]), mode, limit)
+
+@app.post("/analytics/critical-issues/")
+async def analytics_critical_issues(file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None), limit: int = Form(10)):
+    """
+    Returns the most severe failed, overdue or high-risk items, one per name; the PDF report lists the top 10.
+    """
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    _, entry = await load_dataset(file, dataset_id)
+    return {"critical_issues": await run_compute(compute_critical_issues, entry, mode, limit)}
+
+# Placeholder sections until root-cause and cross-framework analysis are implemented;
+# BENCHMARKS is used until the metrics history has peers for a mode
+BENCHMARKS = {"industry_avg_overdue": 5, "industry_avg_failed": 3}
+ROOT_CAUSE = "Most failures are due to missing evidence in IT controls."
+CROSS_FRAMEWORK = {"sox_iso_overlap": 12, "soc2_iso_overlap": 8}
+BUNDLE_FIELDS = ("trends", "owner_performance", "benchmarks", "root_cause", "heatmap", "cross_framework")
 
 @app.post("/analytics/benchmarks/")
-async def analytics_benchmarks(file: UploadFile = File(...), mode: str = Form("sox")):
+async def analytics_benchmarks(file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None), current_user: Optional[str] = Depends(get_optional_user)):
     """
-    Returns static/dynamic industry benchmark data (placeholder for now).
+    Returns peer benchmarks from other users' latest recorded datasets, and where the caller ranks among them.
     """
-    return {"benchmarks": {"industry_avg_overdue": 5, "industry_avg_failed": 3}}
+    return {"benchmarks": await run_io(compute_benchmarks, mode, current_user)}
 
 @app.post("/analytics/root-cause/")
-async def analytics_root_cause(file: UploadFile = File(...), mode: str = Form("sox")):
+async def analytics_root_cause(file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None)):
     """
     Returns AI clustering/explanation of failures (placeholder for now).
     """
-    return {"root_cause": "Most failures are due to missing evidence in IT controls."}
+    return {"root_cause": ROOT_CAUSE}
+
+# Column pairs tried in order for each framework's default heatmap, then a
+# single-column distribution (column, title) when no pair is present
+HEATMAP_AXES = {
+    "sox": ([("Risk Rating", "Frequency"), ("Risk Rating", "Result")], ("Risk Rating", "Risk Distribution")),
+    "esg": ([("ESG Factor", "Status"), ("ESG Factor", "Metric")], ("ESG Factor", "ESG Factor Distribution")),
+    "soc2": ([("Trust Service Criteria", "Status"), ("Trust Service Criteria", "Control Type")], ("Trust Service Criteria", "Trust Service Criteria Distribution")),
+    "iso27001": ([("Status", "Control Category"), ("Status", "Annex A Reference")], ("Status", "Status Distribution")),
+}
+
+def heatmap_column(df, name):
+    """A dataset column, or the derived "Control Category" (leading letters of Control ID); None if unavailable."""
+    if name in df.columns:
+        return df[name]
+    if name == "Control Category" and "Control ID" in df.columns:
+        return df["Control ID"].str.extract(r'([A-Z]+)', expand=False).rename(name)
+    return None
+
+def compute_heatmap(entry, mode, row_field=None, column_field=None, top_k=HEATMAP_TOP_K):
+    """
+    Heatmap payload for a pair of columns: the requested pair, or else the
+    framework's default pair. Returns {"heatmap": nested counts, "crosstab":
+    sparse table}; "crosstab" is None for single-column distributions.
+    """
+    df = entry["df"]
+    if row_field is not None:
+        table = crosstab(df[row_field], df[column_field], top_k, HEATMAP_MAX_CELLS)
+        return {"heatmap": crosstab_nested(table), "crosstab": table}
+
+    pairs, (dist_col, dist_title) = HEATMAP_AXES.get(mode, ([], (None, None)))
+    table = None
+    for row_name, col_name in pairs:
+        rows, columns = heatmap_column(df, row_name), heatmap_column(df, col_name)
+        if rows is not None and columns is not None:
+            table = crosstab(rows, columns, top_k, HEATMAP_MAX_CELLS)
+            break
+    else:
+        if dist_col in df.columns:
+            return {"heatmap": {dist_title: df[dist_col].value_counts().head(top_k).to_dict()}, "crosstab": None}
+
+    # If no meaningful heatmap data could be generated, use the first two categorical columns
+    if table is None or not table["cells"]:
+        categorical_cols = df.select_dtypes(include=['object', 'category', 'string']).columns
+        if len(categorical_cols) < 2:
+            return {"heatmap": {"No Data": {"No Categories": 0}}, "crosstab": None}
+        table = crosstab(df[categorical_cols[0]], df[categorical_cols[1]], top_k, HEATMAP_MAX_CELLS)
+    return {"heatmap": crosstab_nested(table), "crosstab": table}
 
 @app.post("/analytics/heatmap/")
-async def analytics_heatmap(file: UploadFile = File(...), mode: str = Form("sox")):
+async def analytics_heatmap(
+    file: Optional[UploadFile] = File(None),
+    mode: str = Form("sox"),
+    dataset_id: Optional[str] = Form(None),
+    row_field: Optional[str] = Form(None),
+    column_field: Optional[str] = Form(None),
+    top_k: int = Form(HEATMAP_TOP_K),
+):
     """
-    Returns risk vs. frequency or coverage heatmap data based on the uploaded dataset.
+    Returns risk vs. frequency or coverage heatmap data based on the uploaded dataset,
+    or a crosstab of any two columns given as row_field and column_field.
     """
     try:
-        ext = file.filename.split('.')[-1].lower()
-        df = pd.read_csv(BytesIO(await file.read())) if ext == "csv" else pd.read_excel(BytesIO(await file.read()))
-        
-        heatmap_data = {}
-        
-        if mode == "sox":
-            if "Risk Rating" in df.columns and "Frequency" in df.columns:
-                # Create risk vs frequency heatmap
-                risk_freq_data = df.groupby(['Risk Rating', 'Frequency']).size().unstack(fill_value=0)
-                heatmap_data = risk_freq_data.to_dict()
-            elif "Risk Rating" in df.columns and "Result" in df.columns:
-                # Create risk vs result heatmap
-                risk_result_data = df.groupby(['Risk Rating', 'Result']).size().unstack(fill_value=0)
-                heatmap_data = risk_result_data.to_dict()
-            else:
-                # Fallback to basic risk distribution
-                if "Risk Rating" in df.columns:
-                    risk_dist = df['Risk Rating'].value_counts().to_dict()
-                    heatmap_data = {"Risk Distribution": risk_dist}
-                
-        elif mode == "esg":
-            if "ESG Factor" in df.columns and "Status" in df.columns:
-                # Create ESG factor vs status heatmap
-                esg_status_data = df.groupby(['ESG Factor', 'Status']).size().unstack(fill_value=0)
-                heatmap_data = esg_status_data.to_dict()
-            elif "ESG Factor" in df.columns and "Metric" in df.columns:
-                # Create ESG factor vs metric count heatmap
-                esg_metric_data = df.groupby(['ESG Factor', 'Metric']).size().unstack(fill_value=0)
-                heatmap_data = esg_metric_data.to_dict()
-            else:
-                # Fallback to ESG factor distribution
-                if "ESG Factor" in df.columns:
-                    esg_dist = df['ESG Factor'].value_counts().to_dict()
-                    heatmap_data = {"ESG Factor Distribution": esg_dist}
-                    
-        elif mode == "soc2":
-            if "Trust Service Criteria" in df.columns and "Status" in df.columns:
-                # Create TSC vs status heatmap
-                tsc_status_data = df.groupby(['Trust Service Criteria', 'Status']).size().unstack(fill_value=0)
-                heatmap_data = tsc_status_data.to_dict()
-            elif "Trust Service Criteria" in df.columns and "Control Type" in df.columns:
-                # Create TSC vs control type heatmap
-                tsc_type_data = df.groupby(['Trust Service Criteria', 'Control Type']).size().unstack(fill_value=0)
-                heatmap_data = tsc_type_data.to_dict()
-            else:
-                # Fallback to TSC distribution
-                if "Trust Service Criteria" in df.columns:
-                    tsc_dist = df['Trust Service Criteria'].value_counts().to_dict()
-                    heatmap_data = {"Trust Service Criteria Distribution": tsc_dist}
-                    
-        elif mode == "iso27001":
-            if "Status" in df.columns and "Control ID" in df.columns:
-                # Create status vs control ID pattern heatmap
-                # Extract first part of control ID for grouping
-                df['Control Category'] = df['Control ID'].str.extract(r'([A-Z]+)', expand=False)
-                if 'Control Category' in df.columns:
-                    status_category_data = df.groupby(['Status', 'Control Category']).size().unstack(fill_value=0)
-                    heatmap_data = status_category_data.to_dict()
-            elif "Status" in df.columns and "Annex A Reference" in df.columns:
-                # Create status vs annex reference heatmap
-                status_annex_data = df.groupby(['Status', 'Annex A Reference']).size().unstack(fill_value=0)
-                heatmap_data = status_annex_data.to_dict()
-            else:
-                # Fallback to status distribution
-                if "Status" in df.columns:
-                    status_dist = df['Status'].value_counts().to_dict()
-                    heatmap_data = {"Status Distribution": status_dist}
-        
-        # If no meaningful heatmap data could be generated, provide a basic distribution
-        if not heatmap_data:
-            # Try to find any categorical columns for basic distribution
-            categorical_cols = df.select_dtypes(include=['object']).columns
-            if len(categorical_cols) >= 2:
-                col1, col2 = categorical_cols[:2]
-                basic_data = df.groupby([col1, col2]).size().unstack(fill_value=0)
-                heatmap_data = basic_data.to_dict()
-            else:
-                # Last resort - return empty heatmap
-                heatmap_data = {"No Data": {"No Categories": 0}}
-        
-        return {"heatmap": heatmap_data}
-        
+        if (row_field is None) != (column_field is None):
+            raise HTTPException(status_code=400, detail="row_field and column_field must be given together")
+        if not 1 <= top_k <= 100:
+            raise HTTPException(status_code=400, detail="top_k must be between 1 and 100")
+        _, entry = await load_dataset(file, dataset_id)
+        if row_field is not None:
+            missing = [c for c in (row_field, column_field) if c not in entry["df"].columns]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Unknown column(s): {', '.join(missing)}")
+        key = ("heatmap", mode, row_field, column_field, top_k)
+        return await run_compute(dataset_aggregate, entry, key, lambda: compute_heatmap(entry, mode, row_field, column_field, top_k))
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating heatmap: {e}")
         return {"heatmap": {"Error": {"Could not generate": 0}}}
 
 @app.post("/analytics/cross-framework/")
-async def analytics_cross_framework(file: UploadFile = File(...), mode: str = Form("sox")):
+async def analytics_cross_framework(file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None)):
     """
     Returns cross-framework mapping/overlap/gap analysis (placeholder for now).
     """
-    return {"cross_framework": {"sox_iso_overlap": 12, "soc2_iso_overlap": 8}}
+    return {"cross_framework": CROSS_FRAMEWORK}
 
-def create_compliance_charts(df, mode, compliance_score, failed_pct, overdue_pct, missing_owner_pct):
+def compute_bundle(entry, mode, fields, user=None):
     """
-    Create matplotlib charts for the PDF report with proper error handling
+    Every requested analytics section for one dataset, keyed as the individual
+    endpoints key them. Sections share one NormalizedFrame, so masks and parsed
+    dates are derived once. A section that fails gets the same placeholder its
+    endpoint would return instead of failing the whole bundle.
     """
-    charts = []
-    
-    try:
-        matplotlib.use('Agg')
-        
-        # Set a consistent style
-        plt.style.use('default')
-        
-        # Create compliance score breakdown chart
-        fig, ax = plt.subplots(figsize=(10, 6))
-        categories = ['Passed', 'Failed', 'Overdue', 'Missing Owner']
-        values = [100-failed_pct-overdue_pct-missing_owner_pct, failed_pct, overdue_pct, missing_owner_pct]
-        
-        # Use hex colors to avoid matplotlib color issues
-        colors = ['#2E8B57', '#DC143C', '#FF8C00', '#696969']
-        
-        bars = ax.bar(categories, values, color=colors, alpha=0.8)
-        ax.set_ylabel('Percentage (%)', fontsize=12)
-        ax.set_title(f'{mode.upper()} Compliance Score: {compliance_score:.1f}%', fontsize=14, fontweight='bold')
-        ax.set_ylim(0, 100)
-        
-        # Add value labels on bars
-        for bar, value in zip(bars, values):
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height + 1,
-                   f'{value:.1f}%', ha='center', va='bottom', fontweight='bold')
-        
-        plt.tight_layout()
-        
-        # Save chart to buffer
-        chart_buffer = BytesIO()
-        plt.savefig(chart_buffer, format='png', dpi=300, bbox_inches='tight', facecolor='white')
-        chart_buffer.seek(0)
-        plt.close()
-        
-        charts.append(('compliance_score', chart_buffer))
-        print("Compliance score chart created successfully")
-        
-    except Exception as e:
-        print(f"Error creating compliance score chart: {e}")
-    
-    try:
-        # Create risk distribution chart if applicable
-        if mode == "sox" and "Risk Rating" in df.columns:
-            risk_counts = df['Risk Rating'].value_counts()
-            
-            fig, ax = plt.subplots(figsize=(10, 6))
-            colors = ['#FF6B6B', '#FFE66D', '#4ECDC4']
-            
-            wedges, texts, autotexts = ax.pie(risk_counts.values, labels=risk_counts.index, 
-                                             autopct='%1.1f%%', colors=colors[:len(risk_counts)],
-                                             startangle=90)
-            ax.set_title('Risk Rating Distribution', fontsize=14, fontweight='bold')
-            
-            plt.tight_layout()
-            
-            risk_buffer = BytesIO()
-            plt.savefig(risk_buffer, format='png', dpi=300, bbox_inches='tight', facecolor='white')
-            risk_buffer.seek(0)
-            plt.close()
-            
-            charts.append(('risk_distribution', risk_buffer))
-            print("Risk distribution chart created successfully")
-            
-    except Exception as e:
-        print(f"Error creating risk distribution chart: {e}")
-    
+    nf = NormalizedFrame(entry["df"], views=entry["views"])
+    bundle = {}
+
+    def section(name, build, fallback):
+        try:
+            bundle.update(build())
+        except Exception as e:
+            print(f"Error generating {name}: {e}")
+            bundle.update(fallback)
+
+    if "trends" in fields:
+        granularity = "month"
+        section("trends", lambda: dict(zip(("trends", "series"), compute_trends(entry, mode, granularity, nf=nf)), granularity=granularity),
+                {"trends": {"Error": {"Could not generate": 0}}, "granularity": granularity, "series": []})
+    if "owner_performance" in fields:
+        section("owner performance", lambda: dict(zip(("owner_performance", "total_owners"), compute_owner_performance(entry, mode, nf=nf))),
+                {"owner_performance": {}, "total_owners": 0})
+    if "benchmarks" in fields:
+        section("benchmarks", lambda: {"benchmarks": compute_benchmarks(mode, user)},
+                {"benchmarks": {"error": "Could not generate benchmarks"}})
+    if "root_cause" in fields:
+        bundle["root_cause"] = ROOT_CAUSE
+    if "heatmap" in fields:
+        section("heatmap", lambda: dataset_aggregate(entry, ("heatmap", mode, None, None, HEATMAP_TOP_K), lambda: compute_heatmap(entry, mode)),
+                {"heatmap": {"Error": {"Could not generate": 0}}})
+    if "cross_framework" in fields:
+        bundle["cross_framework"] = CROSS_FRAMEWORK
+    return bundle
+
+@app.post("/analytics/bundle")
+async def analytics_bundle(
+    background_tasks: BackgroundTasks,
+    file: Optional[UploadFile] = File(None),
+    mode: str = Form("sox"),
+    dataset_id: Optional[str] = Form(None),
+    fields: Optional[str] = Form(None),
+    current_user: Optional[str] = Depends(get_optional_user),
+):
+    """
+    Returns several analytics sections for one upload or dataset_id in a single response.
+    `fields` is a comma-separated subset of BUNDLE_FIELDS; all sections by default.
+    """
+    requested = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(BUNDLE_FIELDS)
+    unknown = [f for f in requested if f not in BUNDLE_FIELDS]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"fields must be a comma-separated subset of: {', '.join(BUNDLE_FIELDS)}")
+    dataset_id, entry = await load_dataset(file, dataset_id)
+    bundle = await run_compute(compute_bundle, entry, mode, set(requested), current_user)
+    background_tasks.add_task(record_metrics, entry, dataset_id, mode, current_user)
+    return {"dataset_id": dataset_id, **bundle}
+
+# --- Metrics history ---
+metrics_store = MetricsStore(METRICS_DB_FILE)
+
+async def record_metrics(entry, dataset_id: str, mode: str, user: Optional[str]):
+    """Add a dataset's headline and per-owner metrics to the history, once per user, mode and dataset."""
+    if mode not in FRAMEWORK_COLUMNS:
+        return
     try:
-        # Create owner performance chart if applicable
-        owner_col = "Owner" if mode in ["sox", "esg", "soc2"] else "Control Owner"
-        if owner_col in df.columns:
-            owner_stats = df.groupby(owner_col).size().sort_values(ascending=False).head(8)
-            
-            fig, ax = plt.subplots(figsize=(12, 6))
-            colors = ['#3498DB', '#E74C3C', '#2ECC71', '#F39C12', '#9B59B6', '#1ABC9C', '#E67E22', '#34495E']
-            
-            bars = ax.bar(range(len(owner_stats)), owner_stats.values, 
-                         color=colors[:len(owner_stats)], alpha=0.8)
-            ax.set_xlabel('Control Owners', fontsize=12)
-            ax.set_ylabel('Number of Controls', fontsize=12)
-            ax.set_title('Control Distribution by Owner', fontsize=14, fontweight='bold')
-            ax.set_xticks(range(len(owner_stats)))
-            ax.set_xticklabels(owner_stats.index, rotation=45, ha='right')
-            
-            # Add value labels on bars
-            for bar, value in zip(bars, owner_stats.values):
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width()/2., height + 0.1,
-                       str(value), ha='center', va='bottom', fontweight='bold')
-            
-            plt.tight_layout()
-            
-            owner_buffer = BytesIO()
-            plt.savefig(owner_buffer, format='png', dpi=300, bbox_inches='tight', facecolor='white')
-            owner_buffer.seek(0)
-            plt.close()
-            
-            charts.append(('owner_performance', owner_buffer))
-            print("Owner performance chart created successfully")
-            
+        if await run_io(metrics_store.has, user, mode, dataset_id):
+            return
+
+        def summarize():
+            nf = NormalizedFrame(entry["df"], views=entry["views"])
+            stats = owner_performance(nf, mode)
+            owners = [] if stats is None else [
+                (str(row.Index), int(row.total), int(row.failed), int(row.overdue)) for row in stats.itertuples()
+            ]
+            return compliance_summary(nf, mode), owners
+
+        summary, owners = await run_compute(summarize)
+        await run_io(metrics_store.record, user, mode, dataset_id, entry["filename"], summary, owners)
     except Exception as e:
-        print(f"Error creating owner performance chart: {e}")
-    
+        print(f"Error recording metrics for {dataset_id}: {e}")
+
+def compute_benchmarks(mode: str, user: Optional[str]):
+    """
+    Averages of other users' latest snapshots for a mode within BENCHMARK_WINDOW_DAYS,
+    plus the caller's latest compliance score and its percentile among them.
+    """
+    latest = metrics_store.latest_per_user(mode, since=time.time() - BENCHMARK_WINDOW_DAYS * 86400)
+    own = latest.pop(user or "", None)
+    if not latest:
+        return {**BENCHMARKS, "peers": 0, "source": "default"}
+    peers = list(latest.values())
+
+    def average(field):
+        return round(sum(p[field] for p in peers) / len(peers), 2)
+
+    benchmarks = {
+        "industry_avg_overdue": average("overdue_pct"),
+        "industry_avg_failed": average("failed_pct"),
+        "industry_avg_missing_owner": average("missing_owner_pct"),
+        "industry_avg_compliance_score": average("compliance_score"),
+        "peers": len(peers),
+        "source": "history",
+    }
+    if own is not None:
+        benchmarks["compliance_score"] = round(own["compliance_score"], 2)
+        benchmarks["percentile"] = round(100 * sum(p["compliance_score"] < own["compliance_score"] for p in peers) / len(peers), 1)
+    return benchmarks
+
+@app.get("/analytics/history")
+async def analytics_history(mode: str = "sox", owner: Optional[str] = None, days: Optional[int] = None, limit: int = 100, current_user: Optional[str] = Depends(get_optional_user)):
+    """
+    Returns the caller's recorded datasets for a mode, oldest first, with their headline
+    metrics, or one owner's counts across them when `owner` is given.
+    """
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    since = time.time() - days * 86400 if days else 0
+    if owner is not None:
+        rows = await run_io(metrics_store.owner_history, current_user, mode, owner, since, limit)
+    else:
+        rows = await run_io(metrics_store.history, current_user, mode, since, limit)
+    for row in rows:
+        row["created_at"] = datetime.fromtimestamp(row.pop("created")).isoformat()
+    return {"mode": mode, "owner": owner, "history": rows}
+
+# --- Charts ---
+chart_cache = ChartCache(CHART_CACHE_MAX_ENTRIES, CHART_CACHE_MAX_BYTES)
+
+def compliance_summary(nf: NormalizedFrame, mode: str) -> dict:
+    """compliance_counts plus the percentages and overall score shown in reports."""
+    counts = compliance_counts(nf, mode)
+    total_items = counts["total"]
+    failed_pct = (counts["failed"] / total_items * 100) if total_items > 0 else 0
+    overdue_pct = (counts["overdue"] / total_items * 100) if total_items > 0 else 0
+    missing_owner_pct = (counts["missing_owner"] / total_items * 100) if total_items > 0 else 0
+
+    # Calculate compliance score
+    if mode == "iso27001":
+        compliance_score = max(0, 100 - failed_pct - overdue_pct - missing_owner_pct - (counts["missing_evidence"] / total_items * 100 if total_items > 0 else 0) - (counts["missing_annex"] / total_items * 100 if total_items > 0 else 0))
+    else:
+        compliance_score = max(0, 100 - failed_pct - overdue_pct - missing_owner_pct)
+    return {**counts, "failed_pct": failed_pct, "overdue_pct": overdue_pct, "missing_owner_pct": missing_owner_pct, "compliance_score": compliance_score}
+
+def chart_series(df, mode, compliance_score, failed_pct, overdue_pct, missing_owner_pct, nf=None):
+    """
+    Aggregate the report charts' inputs into small JSON-serializable series, as an
+    ordered list of (chart kind, data). Charts without the columns they need are skipped.
+    """
+    nf = nf or NormalizedFrame(df)
+    series = [("compliance_score", {
+        "mode": mode,
+        "compliance_score": float(compliance_score),
+        "failed_pct": float(failed_pct),
+        "overdue_pct": float(overdue_pct),
+        "missing_owner_pct": float(missing_owner_pct),
+    })]
+
+    if mode == "sox" and "Risk Rating" in df.columns:
+        risk_counts = df['Risk Rating'].value_counts()
+        series.append(("risk_distribution", {"labels": [str(k) for k in risk_counts.index], "values": [int(v) for v in risk_counts.values]}))
+
+    owner_col = "Owner" if mode in ["sox", "esg", "soc2"] else "Control Owner"
+    if owner_col in df.columns:
+        owner_stats = df.groupby(owner_col, observed=True).size().sort_values(ascending=False).head(8)
+        series.append(("owner_performance", {"labels": [str(k) for k in owner_stats.index], "values": [int(v) for v in owner_stats.values]}))
+
+    if "Due Date" in df.columns:
+        overdue_by_month = nf.dates('Due Date')[nf.older_than('Due Date')].dt.to_period('M').value_counts().sort_index()
+        if not overdue_by_month.empty and len(overdue_by_month) > 1:
+            series.append(("trend_analysis", {"labels": [str(k) for k in overdue_by_month.index], "values": [int(v) for v in overdue_by_month.values]}))
+    return series
+
+async def render_chart_cached(kind: str, data: dict, fmt: str, profile: str) -> bytes:
+    """Render a chart on the render pool unless the same chart is already cached."""
+    key = chart_key(kind, data, fmt, profile)
+    content = chart_cache.get(key)
+    if content is None:
+        content = await run_render(render_chart, kind, data, fmt, profile)
+        chart_cache.put(key, content)
+    return content
+
+def chart_flowable(chart_buffer: BytesIO, width: float, height: float):
+    """A ReportLab flowable for a rendered chart: vector drawing for SVG, image otherwise."""
+    from reportlab.platypus import Image
+    if not chart_buffer.getvalue().startswith(b"\x89PNG") and svg2rlg is not None:
+        drawing = svg2rlg(chart_buffer)
+        drawing.scale(width / drawing.width, height / drawing.height)
+        drawing.width, drawing.height = width, height
+        return drawing
+    chart_img = Image(chart_buffer)
+    chart_img.drawHeight = height
+    chart_img.drawWidth = width
+    return chart_img
+
+async def create_compliance_charts(series, fmt=None, profile=None):
+    """
+    Render the PDF report charts for chart_series output as (name, BytesIO) pairs.
+    Charts render concurrently on the render pool, which only receives the small
+    aggregated series; identical inputs are served from the render cache. SVG
+    output needs svglib to embed in the PDF, so PNG is used when it is missing.
+    """
+    fmt = fmt or CHART_FORMAT
+    if fmt == "svg" and svg2rlg is None:
+        fmt = "png"
+    profile = profile or CHART_PROFILE
+    results = await asyncio.gather(
+        *(render_chart_cached(kind, data, fmt, profile) for kind, data in series),
+        return_exceptions=True,
+    )
+    charts = []
+    for (kind, _), result in zip(series, results):
+        if isinstance(result, Exception):
+            print(f"Error creating {kind} chart: {result}")
+            continue
+        charts.append((kind, BytesIO(result)))
+        print(f"{CHART_TITLES[kind]} chart created successfully")
+    return charts
+
+@app.post("/charts/{kind}")
+async def get_chart(kind: str, file: Optional[UploadFile] = File(None), mode: str = Form("sox"), dataset_id: Optional[str] = Form(None), profile: str = Form("web"), format: str = Form("png")):
+    """Render a single report chart, by default as a low-DPI web preview."""
+    if kind not in CHART_TITLES or profile not in CHART_PROFILES or format not in CHART_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown chart, profile or format; charts are {', '.join(CHART_TITLES)}")
     try:
-        # Create time series chart for overdue items if applicable
-        if "Due Date" in df.columns:
-            df_temp = df.copy()
-            df_temp['Due Date'] = pd.to_datetime(df_temp['Due Date'], errors='coerce')
-            overdue_by_month = df_temp[df_temp['Due Date'] < pd.Timestamp.now()].groupby(
-                df_temp['Due Date'].dt.to_period('M')
-            ).size()
-            
-            if not overdue_by_month.empty and len(overdue_by_month) > 1:
-                fig, ax = plt.subplots(figsize=(12, 6))
-                
-                overdue_by_month.plot(kind='line', marker='o', ax=ax, color='#E74C3C', linewidth=2, markersize=6)
-                ax.set_xlabel('Month', fontsize=12)
-                ax.set_ylabel('Number of Overdue Items', fontsize=12)
-                ax.set_title('Overdue Items Trend', fontsize=14, fontweight='bold')
-                ax.grid(True, alpha=0.3)
-                
-                plt.tight_layout()
-                
-                trend_buffer = BytesIO()
-                plt.savefig(trend_buffer, format='png', dpi=300, bbox_inches='tight', facecolor='white')
-                trend_buffer.seek(0)
-                plt.close()
-                
-                charts.append(('trend_analysis', trend_buffer))
-                print("Trend analysis chart created successfully")
-                
+        _, entry = await load_dataset(file, dataset_id)
+        nf = NormalizedFrame(entry["df"], views=entry["views"])
+
+        def aggregate():
+            summary = compliance_summary(nf, mode)
+            return dict(chart_series(entry["df"], mode, summary["compliance_score"], summary["failed_pct"], summary["overdue_pct"], summary["missing_owner_pct"], nf))
+
+        series = await run_compute(aggregate)
+        if kind not in series:
+            raise HTTPException(status_code=404, detail=f"This dataset has no data for the {kind} chart")
+        content = await render_chart_cached(kind, series[kind], format, profile)
+        return Response(content, media_type=CHART_FORMATS[format])
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error creating trend analysis chart: {e}")
-    
-    return charts
+        print(f"Error rendering chart {kind}: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+import time
+
+SNAPSHOT_FIELDS = ("total", "compliance_score", "failed_pct", "overdue_pct", "missing_owner_pct")
+
+
+class MetricsStore:
+    """
+    History of analyzed datasets in a SQLite file: one snapshot row per user,
+    mode and dataset with the headline metrics, plus per-owner counts. Anonymous
+    users are stored as "". Queries read the indexed summary rows, never the
+    original files.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "id INTEGER PRIMARY KEY, user TEXT NOT NULL, mode TEXT NOT NULL, dataset_id TEXT NOT NULL, "
+            "filename TEXT, created REAL NOT NULL, total INTEGER NOT NULL, compliance_score REAL NOT NULL, "
+            "failed_pct REAL NOT NULL, overdue_pct REAL NOT NULL, missing_owner_pct REAL NOT NULL, "
+            "UNIQUE (user, mode, dataset_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS snapshots_user_mode_created ON snapshots (user, mode, created)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS snapshots_mode_created ON snapshots (mode, created)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS owner_metrics ("
+            "snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE, owner TEXT NOT NULL, "
+            "total INTEGER NOT NULL, failed INTEGER NOT NULL, overdue INTEGER NOT NULL, "
+            "PRIMARY KEY (snapshot_id, owner))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS owner_metrics_owner ON owner_metrics (owner)")
+        self._conn.commit()
+
+    def has(self, user, mode: str, dataset_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM snapshots WHERE user = ? AND mode = ? AND dataset_id = ?", (user or "", mode, dataset_id)
+            ).fetchone() is not None
+
+    def record(self, user, mode: str, dataset_id: str, filename: str, summary: dict, owners=()):
+        """
+        Store a dataset's summary (SNAPSHOT_FIELDS) and its (owner, total, failed,
+        overdue) rows. A dataset already recorded for this user and mode is kept
+        as is; returns whether a snapshot was added.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO snapshots (user, mode, dataset_id, filename, created, "
+                + ", ".join(SNAPSHOT_FIELDS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user or "", mode, dataset_id, filename, time.time(), *(summary[f] for f in SNAPSHOT_FIELDS)),
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO owner_metrics (snapshot_id, owner, total, failed, overdue) VALUES (?, ?, ?, ?, ?)",
+                ((cursor.lastrowid, *owner) for owner in owners),
+            )
+            self._conn.commit()
+            return True
+
+    def history(self, user, mode: str, since: float = 0, limit: int = 100):
+        """A user's snapshots for a mode, oldest first: the most recent `limit` since `since`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dataset_id, filename, created, " + ", ".join(SNAPSHOT_FIELDS) + " FROM snapshots "
+                "WHERE user = ? AND mode = ? AND created >= ? ORDER BY created DESC LIMIT ?",
+                (user or "", mode, since, limit),
+            ).fetchall()
+        keys = ("dataset_id", "filename", "created") + SNAPSHOT_FIELDS
+        return [dict(zip(keys, row)) for row in reversed(rows)]
+
+    def owner_history(self, user, mode: str, owner: str, since: float = 0, limit: int = 100):
+        """One owner's counts across a user's snapshots for a mode, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.dataset_id, s.created, o.total, o.failed, o.overdue FROM owner_metrics o "
+                "JOIN snapshots s ON s.id = o.snapshot_id "
+                "WHERE s.user = ? AND s.mode = ? AND o.owner = ? AND s.created >= ? ORDER BY s.created DESC LIMIT ?",
+                (user or "", mode, owner, since, limit),
+            ).fetchall()
+        keys = ("dataset_id", "created", "total", "failed", "overdue")
+        return [dict(zip(keys, row)) for row in reversed(rows)]
+
+    def latest_per_user(self, mode: str, since: float = 0):
+        """Each user's most recent snapshot for a mode, as {user: summary}."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user, " + ", ".join(SNAPSHOT_FIELDS) + " FROM snapshots s "
+                "WHERE mode = ? AND created >= ? AND created = ("
+                "SELECT MAX(created) FROM snapshots WHERE user = s.user AND mode = s.mode)",
+                (mode, since),
+            ).fetchall()
+        return {row[0]: dict(zip(SNAPSHOT_FIELDS, row[1:])) for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,190 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "string"
+
+# Text columns whose share of distinct values is at or below this ratio become categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+DATE_COLUMNS = {"due date", "last test date", "last review date", "last updated"}
+
+
+def is_text(s: pd.Series) -> bool:
+    return s.dtype == object or isinstance(s.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(s)
+
+
+def is_date_column(col) -> bool:
+    name = str(col).strip().lower()
+    return name in DATE_COLUMNS or name.endswith(" date")
+
+
+def _by_category(s: pd.Series, compute, fill: bool) -> pd.Series:
+    """Evaluate a boolean `compute` once per category and broadcast it back through the codes."""
+    values = compute(pd.Series(s.cat.categories, dtype=object)).to_numpy(dtype=bool)
+    # Missing values have code -1, which picks up the appended fill value
+    return pd.Series(np.append(values, fill)[s.cat.codes.to_numpy()], index=s.index, name=s.name)
+
+
+def lower_view(s: pd.Series) -> pd.Series:
+    """Lowercased text view; categoricals stay categorical with merged categories."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        folded = pd.Series(s.cat.categories, dtype=object).astype(str).str.lower()
+        new_codes, uniques = pd.factorize(folded)
+        codes = np.append(new_codes, -1)[s.cat.codes.to_numpy()]
+        return pd.Series(pd.Categorical.from_codes(codes, categories=uniques), index=s.index, name=s.name)
+    if not is_text(s):
+        s = s.astype(str).where(s.notna())
+    return s.str.lower()
+
+
+def contains_view(lowered: pd.Series, pattern: str) -> pd.Series:
+    if isinstance(lowered.dtype, pd.CategoricalDtype):
+        return _by_category(lowered, lambda cats: cats.str.contains(pattern, na=False), False)
+    return lowered.str.contains(pattern, na=False).astype(bool)
+
+
+def blank_view(s: pd.Series) -> pd.Series:
+    """True where a value is missing or only whitespace."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return _by_category(s, lambda cats: cats.astype(str).str.strip().eq(""), True)
+    return (s.isnull() | s.astype(str).str.strip().eq("")).astype(bool)
+
+
+def numeric_view(s: pd.Series) -> pd.Series:
+    if not pd.api.types.is_numeric_dtype(s):
+        s = s.astype(object)
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _first_value(s: pd.Series):
+    non_null = s.dropna()
+    return str(non_null.iloc[0]).strip() if len(non_null) else None
+
+
+def _dayfirst(fmt):
+    return "%d" in fmt and "%m" in fmt and fmt.index("%d") < fmt.index("%m")
+
+
+def infer_date_format(s: pd.Series, col=None, formats=None):
+    """
+    Decide how to parse a column's dates, as (format, dayfirst). The format is
+    guessed from the first value the same way pandas does ("mixed" when no single
+    format fits); dayfirst is how cells that format misses are read, following
+    the format's own day/month order. `formats` holds the decisions made so far
+    within one run (e.g. earlier chunks of the same file), keyed by column. The
+    first decision for a column holds for the rest of the run, so a chunked run
+    parses every cell exactly as a whole-file run would. Returns None when the
+    column has no values and nothing is pinned yet.
+    """
+    if formats is not None and col in formats:
+        return formats[col]
+    first = _first_value(s)
+    if first is None:
+        return None
+    fmt = guess_datetime_format(first) or "mixed"
+    decision = (fmt, fmt != "mixed" and _dayfirst(fmt))
+    if formats is not None:
+        formats[col] = decision
+    return decision
+
+
+def parse_dates(s: pd.Series, col=None, decision=None) -> pd.Series:
+    """
+    Parse a column to datetimes; invalid values become NaT. Cells the guessed
+    format cannot parse fall back to pandas' per-value inference, read in the
+    format's day/month order; every other cell keeps the guessed format's result.
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    decision = decision or infer_date_format(s, col)
+    if decision is None:
+        return pd.to_datetime(s, errors="coerce")
+    fmt, dayfirst = decision
+    parsed = pd.to_datetime(s, format=fmt, errors="coerce")
+    if fmt != "mixed":
+        missed = parsed.isna() & s.notna()
+        if missed.any():
+            fallback = pd.to_datetime(s[missed], format="mixed", dayfirst=dayfirst, errors="coerce")
+            if fallback.dtype == parsed.dtype:
+                parsed[missed] = fallback
+    return parsed
+
+
+def unique_hashes(s: pd.Series) -> np.ndarray:
+    """Sorted 64-bit hashes of a column's distinct values (missing values hash alike)."""
+    return np.unique(pd.util.hash_pandas_object(s, index=False).to_numpy())
+
+
+def normalize_dataframe(df: pd.DataFrame):
+    """
+    Convert a freshly parsed frame into its typed form and precompute the views
+    the rule engine and analytics read. Low-cardinality text becomes categorical,
+    other text uses the Arrow-backed string dtype, and date columns are parsed
+    once. Values and column names are unchanged.
+
+    Returns (typed_df, views) where views maps ("lower" | "blank" | "dates", column)
+    to a Series aligned with typed_df.
+    """
+    typed_df = df.copy(deep=False)
+    views = {}
+    n = len(df)
+    for i, col in enumerate(df.columns):
+        s = df.iloc[:, i]
+        if is_text(s) and not isinstance(s.dtype, pd.CategoricalDtype):
+            if is_date_column(col):
+                s = s.astype(STRING_DTYPE)
+            elif s.nunique(dropna=True) <= CATEGORY_MAX_RATIO * n:
+                s = s.astype("category")
+            else:
+                s = s.astype(STRING_DTYPE)
+        typed_df.isetitem(i, s)
+        if is_text(s):
+            views[("lower", col)] = lower_view(s)
+            views[("blank", col)] = blank_view(s)
+        if is_date_column(col):
+            views[("dates", col)] = parse_dates(s, col)
+    return typed_df, views
+
+
+COLUMNAR_EXTENSIONS = {"parquet", "arrow", "feather"}
+
+
+def read_dataframe(source, filename: str) -> pd.DataFrame:
+    """Parse raw upload bytes or a file path; the format is taken from the filename extension."""
+    ext = filename.split('.')[-1].lower()
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    if ext == "csv":
+        return pd.read_csv(source)
+    if ext == "parquet":
+        return pd.read_parquet(source)
+    if ext in ("arrow", "feather"):
+        return pd.read_feather(source)
+    return pd.read_excel(source)
+
+
+def load_normalized(source, filename: str):
+    """
+    read_dataframe followed by normalize_dataframe. Module-level and free of app
+    state so it can run in a worker process; returns (typed_df, views, attrs).
+    """
+    df = read_dataframe(source, filename)
+    typed_df, views = normalize_dataframe(df)
+    return typed_df, views, dict(df.attrs)
+
+
+def views_memory_usage(views) -> int:
+    return int(sum(v.memory_usage(deep=True) for v in views.values()))
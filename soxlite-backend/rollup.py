@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+# granularity -> pandas period frequency
+GRANULARITIES = {"day": "D", "week": "W", "month": "M", "quarter": "Q"}
+MEASURES = ("total", "failed", "overdue")
+
+
+def _factorize(values):
+    """Sorted integer codes and labels; missing values get the last code and a None label."""
+    codes, uniques = pd.factorize(pd.Series(values), sort=True)
+    labels = list(uniques)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels.append(None)
+    return codes.astype(np.int64), labels
+
+
+def _dimension(values, keep):
+    if values is None:
+        return np.zeros(int(keep.sum()), dtype=np.int64), [None]
+    return _factorize(np.asarray(values, dtype=object)[keep])
+
+
+def _rollup(keys, n_keys, buckets, n_buckets, counts):
+    """
+    Sum `counts` per (key, bucket), sorted by key then bucket. Returns (offsets,
+    buckets, sums) where the rows for key k are offsets[k]:offsets[k + 1].
+    """
+    cells, inverse = np.unique(keys * n_buckets + buckets, return_inverse=True)
+    sums = np.column_stack([
+        np.bincount(inverse, weights=counts[:, i], minlength=len(cells)) for i in range(counts.shape[1])
+    ]).astype(np.int64)
+    offsets = np.searchsorted(cells // n_buckets, np.arange(n_keys + 1))
+    return offsets, cells % n_buckets, sums
+
+
+class RollupCube:
+    """
+    Counts of total, failed and overdue rows by time bucket, owner and risk.
+    Every granularity in GRANULARITIES is rolled up at build time for all rows,
+    per owner, per risk and per (owner, risk), so a query is a lookup and an
+    array slice rather than a scan of the dataset. Rows without a date are left
+    out. `owners` or `risks` may be None when the dataset lacks that column.
+    """
+
+    def __init__(self, dates, owners, risks, failed, overdue):
+        dates = pd.to_datetime(pd.Series(dates)).reset_index(drop=True)
+        keep = dates.notna().to_numpy()
+        dates = dates[keep]
+        n = len(dates)
+        owner_codes, self.owners = _dimension(owners, keep)
+        risk_codes, self.risks = _dimension(risks, keep)
+        self._owner_codes = {str(label): code for code, label in enumerate(self.owners) if label is not None}
+        self._risk_codes = {str(label): code for code, label in enumerate(self.risks) if label is not None}
+        counts = np.column_stack([
+            np.ones(n, dtype=np.int64),
+            np.asarray(failed, dtype=np.int64)[keep],
+            np.asarray(overdue, dtype=np.int64)[keep],
+        ])
+        n_owners, n_risks = len(self.owners), len(self.risks)
+        self._rollups = {}
+        for granularity, freq in GRANULARITIES.items():
+            bucket_codes, labels = pd.factorize(dates.dt.to_period(freq), sort=True)
+            n_buckets = max(len(labels), 1)
+            self._rollups[granularity] = ([str(label) for label in labels], {
+                "all": _rollup(np.zeros(n, dtype=np.int64), 1, bucket_codes, n_buckets, counts),
+                "owner": _rollup(owner_codes, n_owners, bucket_codes, n_buckets, counts),
+                "risk": _rollup(risk_codes, n_risks, bucket_codes, n_buckets, counts),
+                "owner_risk": _rollup(owner_codes * n_risks + risk_codes, n_owners * n_risks, bucket_codes, n_buckets, counts),
+            })
+
+    def query(self, granularity="month", owner=None, risk=None):
+        """
+        Per-bucket counts for one granularity, optionally for a single owner
+        and/or risk value, as a list of {"period", "total", "failed", "overdue"}
+        in period order. Unknown owners or risks give an empty list.
+        """
+        labels, rollups = self._rollups[granularity]
+        owner_code = self._owner_codes.get(str(owner)) if owner is not None else None
+        risk_code = self._risk_codes.get(str(risk)) if risk is not None else None
+        if (owner is not None and owner_code is None) or (risk is not None and risk_code is None):
+            return []
+        if owner is None and risk is None:
+            offsets, buckets, sums = rollups["all"]
+            key = 0
+        elif risk is None:
+            offsets, buckets, sums = rollups["owner"]
+            key = owner_code
+        elif owner is None:
+            offsets, buckets, sums = rollups["risk"]
+            key = risk_code
+        else:
+            offsets, buckets, sums = rollups["owner_risk"]
+            key = owner_code * len(self.risks) + risk_code
+        lo, hi = offsets[key], offsets[key + 1]
+        return [
+            {"period": labels[bucket], **dict(zip(MEASURES, map(int, row)))}
+            for bucket, row in zip(buckets[lo:hi], sums[lo:hi])
+        ]
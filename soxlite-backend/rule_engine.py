@@ -0,0 +1,448 @@
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+from normalization import (
+    lower_view, contains_view, blank_view, numeric_view, parse_dates, infer_date_format, unique_hashes,
+)
+
+
+class NormalizedFrame:
+    """
+    Lazily computed, memoized views over a DataFrame's columns.
+    Every rule in a plan reads its inputs from here, so each lowercase, blank,
+    date or numeric view is computed at most once per evaluation. `views` seeds
+    the memo with the ones precomputed at ingestion by normalize_dataframe.
+    `date_formats` pins per-column date parsing decisions (see infer_date_format),
+    which keeps chunks of one file parsing dates the same way; decisions first
+    made here are recorded in it.
+    """
+
+    def __init__(self, df: pd.DataFrame, now=None, views=None, date_formats=None):
+        self.df = df
+        self.now = now if now is not None else pd.Timestamp.now()
+        self.date_formats = date_formats
+        self._cache = dict(views) if views else {}
+
+    def _memo(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def lower(self, col):
+        return self._memo(("lower", col), lambda: lower_view(self.df[col]))
+
+    def contains(self, col, pattern):
+        return self._memo(("contains", col, pattern), lambda: contains_view(self.lower(col), pattern))
+
+    def isin(self, col, values):
+        return self._memo(("isin", col, values), lambda: self.lower(col).isin(values).astype(bool))
+
+    def equals(self, col, value):
+        return self._memo(("eq", col, value), lambda: self.lower(col).eq(value).fillna(False).astype(bool))
+
+    def blank(self, col):
+        return self._memo(("blank", col), lambda: blank_view(self.df[col]))
+
+    def dates(self, col):
+        def compute():
+            decision = None
+            if self.date_formats is not None:
+                decision = infer_date_format(self.df[col], col, self.date_formats)
+            return parse_dates(self.df[col], col, decision)
+        return self._memo(("dates", col), compute)
+
+    def numeric(self, col):
+        return self._memo(("numeric", col), lambda: numeric_view(self.df[col]))
+
+    def older_than(self, col, days=0):
+        return self._memo(("older_than", col, days), lambda: self.dates(col) < self.now - pd.Timedelta(days=days))
+
+    def unique_hashes(self, col):
+        return self._memo(("unique_hashes", col), lambda: unique_hashes(self.df[col]))
+
+
+class Rule:
+    """
+    A single declarative check, expressed as a fold so it can run over a whole
+    frame or over a file chunk by chunk. `requires` lists the logical column
+    names the rule needs. `partial` receives the NormalizedFrame followed by the
+    resolved column names and returns an aggregate for those rows, `combine`
+    merges two aggregates, and `finish` turns the final aggregate into a
+    message, or None when the rule does not fire.
+    """
+
+    def __init__(self, kind, requires, partial, combine, finish):
+        self.kind = kind
+        self.requires = tuple(requires)
+        self.partial = partial
+        self.combine = combine
+        self.finish = finish
+
+
+def count_rule(kind, requires, mask, message):
+    """Fires when `mask` matches any row; `message` may reference the matching {count}."""
+    return Rule(
+        kind, requires,
+        partial=lambda nf, *cols: int(mask(nf, *cols).sum()),
+        combine=lambda a, b: a + b,
+        finish=lambda count: message.format(count=count) if count else None,
+    )
+
+
+def coverage_rule(kind, requires, categories, message):
+    """Fires when some of `categories` never appear in the first required column."""
+    def finish(found):
+        missing = [c for c in categories if c not in found]
+        return message.format(missing=", ".join(missing)) if missing else None
+    return Rule(
+        kind, requires,
+        partial=lambda nf, col: frozenset(c for c in categories if nf.contains(col, c.lower()).any()),
+        combine=lambda a, b: a | b,
+        finish=finish,
+    )
+
+
+def duplicate_rule(kind, requires, message):
+    """
+    Fires when values of the first required column repeat; {count} is the number
+    of rows after each value's first occurrence. The aggregate is the row count
+    plus a sorted array of 64-bit value hashes, which stays compact across chunks.
+    """
+    def finish(agg):
+        rows, hashes = agg
+        count = rows - len(hashes)
+        return message.format(count=count) if count else None
+    return Rule(
+        kind, requires,
+        partial=lambda nf, col: (len(nf.df), nf.unique_hashes(col)),
+        combine=lambda a, b: (a[0] + b[0], np.union1d(a[1], b[1])),
+        finish=finish,
+    )
+
+
+def _blank(nf, col, *_):
+    return nf.blank(col)
+
+def _invalid_dates(nf, col, *_):
+    return nf.dates(col).isna()
+
+def _overdue(days):
+    return lambda nf, col, *_: nf.older_than(col, days)
+
+def _failed(pattern):
+    return lambda nf, col, *_: nf.contains(col, pattern)
+
+def _below_threshold(nf, value_col, threshold_col):
+    value, threshold = nf.numeric(value_col), nf.numeric(threshold_col)
+    return (value < threshold) & value.notna() & threshold.notna()
+
+def _high_risk_failed(nf, risk_col, result_col):
+    return nf.isin(risk_col, ("high", "critical")) & nf.contains(result_col, "fail")
+
+def _high_risk_overdue(nf, risk_col, due_col):
+    return nf.isin(risk_col, ("high", "critical")) & nf.older_than(due_col)
+
+def _low_risk_failed(nf, risk_col, result_col):
+    return nf.equals(risk_col, "low") & nf.contains(result_col, "fail")
+
+def _high_risk_rare(nf, risk_col, freq_col):
+    return nf.equals(risk_col, "high") & nf.contains(freq_col, "annual|rare")
+
+def _high_risk_no_frequency(nf, risk_col, freq_col):
+    return nf.equals(risk_col, "high") & nf.blank(freq_col)
+
+
+TSC_CATEGORIES = ("CC", "DC", "AI", "PR", "SL")
+
+ANOMALY = "anomaly"
+ALERT = "alert"
+
+# Rules are evaluated in declaration order, which is also the order messages are reported in.
+# Anomaly rules match column names exactly; alert rules match them case-insensitively.
+RULES = {
+    "sox": [
+        count_rule(ANOMALY, ["Risk Rating", "Result"], _low_risk_failed, "Low-risk controls have failed results."),
+        count_rule(ANOMALY, ["Risk Rating", "Frequency"], _high_risk_rare, "High-risk controls have rare testing frequencies."),
+        count_rule(ANOMALY, ["Owner"], _blank, "{count} control(s) have no assigned owner."),
+        count_rule(ANOMALY, ["Result"], _blank, "{count} control(s) have no result recorded."),
+        count_rule(ANOMALY, ["Due Date"], _overdue(0), "{count} control(s) are overdue."),
+        count_rule(ANOMALY, ["Due Date"], _invalid_dates, "{count} control(s) have invalid or missing due dates."),
+        count_rule(ANOMALY, ["Risk Rating", "Frequency"], _high_risk_no_frequency,
+                   "{count} high-risk control(s) have no testing frequency set."),
+        duplicate_rule(ANOMALY, ["GL Code"], "{count} control(s) have duplicate GL Codes."),
+
+        count_rule(ALERT, ["risk rating", "result"], _high_risk_failed,
+                   "High or critical risk controls have failed results."),
+        count_rule(ALERT, ["risk rating", "due date"], _high_risk_overdue,
+                   "High or critical risk controls are overdue."),
+        count_rule(ALERT, ["owner"], _blank, "Some controls are missing assigned owners."),
+        count_rule(ALERT, ["frequency"], _blank, "Some controls do not have a defined test frequency."),
+        count_rule(ALERT, ["due date"], _overdue(30), "Some controls are overdue by more than 30 days."),
+    ],
+    "esg": [
+        count_rule(ANOMALY, ["Status", "ESG Factor"], _failed("fail"), "{count} ESG metric(s) have failed status."),
+        count_rule(ANOMALY, ["Value", "Threshold"], _below_threshold, "{count} ESG metric(s) are below threshold."),
+        count_rule(ANOMALY, ["Owner"], _blank, "{count} ESG metric(s) have no assigned owner."),
+        count_rule(ANOMALY, ["Status"], _blank, "{count} ESG metric(s) have no status recorded."),
+        count_rule(ANOMALY, ["Due Date"], _overdue(0), "{count} ESG metric(s) are overdue."),
+        count_rule(ANOMALY, ["Due Date"], _invalid_dates, "{count} ESG metric(s) have invalid or missing due dates."),
+        duplicate_rule(ANOMALY, ["ESG Factor"], "{count} ESG metric(s) have duplicate factors."),
+
+        count_rule(ALERT, ["status", "esg factor"], _failed("fail"), "{count} ESG metrics have failed status."),
+        count_rule(ALERT, ["value", "threshold"], _below_threshold, "{count} ESG metrics are below threshold."),
+        count_rule(ALERT, ["owner"], _blank, "Some ESG metrics are missing assigned owners."),
+        count_rule(ALERT, ["due date"], _overdue(0), "Some ESG metrics are overdue."),
+        count_rule(ALERT, ["due date"], _overdue(30), "Some ESG metrics are overdue by more than 30 days."),
+    ],
+    "soc2": [
+        count_rule(ANOMALY, ["Status", "Trust Service Criteria"], _failed("fail"), "{count} SOC 2 control(s) have failed status."),
+        count_rule(ANOMALY, ["Control Type"], _blank, "{count} control(s) have no control type specified."),
+        count_rule(ANOMALY, ["Owner"], _blank, "{count} control(s) have no assigned owner."),
+        count_rule(ANOMALY, ["Status"], _blank, "{count} control(s) have no status recorded."),
+        count_rule(ANOMALY, ["Last Test Date"], _overdue(90), "{count} control(s) haven't been tested in over 90 days."),
+        count_rule(ANOMALY, ["Last Test Date"], _invalid_dates, "{count} control(s) have no test date recorded."),
+        coverage_rule(ANOMALY, ["Trust Service Criteria"], TSC_CATEGORIES, "Missing controls for Trust Service Criteria: {missing}"),
+        duplicate_rule(ANOMALY, ["Control ID"], "{count} control(s) have duplicate Control IDs."),
+
+        count_rule(ALERT, ["status", "trust service criteria"], _failed("fail"), "{count} SOC 2 controls have failed status."),
+        count_rule(ALERT, ["last test date"], _overdue(90), "{count} controls haven't been tested in over 90 days."),
+        count_rule(ALERT, ["owner"], _blank, "Some SOC 2 controls are missing assigned owners."),
+        coverage_rule(ALERT, ["trust service criteria"], TSC_CATEGORIES, "Missing controls for Trust Service Criteria: {missing}"),
+        count_rule(ALERT, ["control type"], _blank, "{count} controls have no control type specified."),
+    ],
+    "iso27001": [
+        count_rule(ANOMALY, ["Status"], _failed("fail|not implemented"), "{count} controls are failed or not implemented."),
+        count_rule(ANOMALY, ["Last Review Date"], _overdue(365), "{count} controls have not been reviewed in over 12 months."),
+        count_rule(ANOMALY, ["Last Review Date"], _invalid_dates, "{count} controls have no review date recorded."),
+        count_rule(ANOMALY, ["Evidence"], _blank, "{count} controls are missing evidence."),
+        count_rule(ANOMALY, ["Control Owner"], _blank, "{count} controls are missing assigned owners."),
+        count_rule(ANOMALY, ["Annex A Reference"], _blank, "{count} controls are missing Annex A references."),
+        duplicate_rule(ANOMALY, ["Control ID"], "{count} controls have duplicate Control IDs."),
+
+        count_rule(ALERT, ["status"], _failed("fail|not implemented"), "{count} controls are failed or not implemented."),
+        count_rule(ALERT, ["last review date"], _overdue(365), "{count} controls have not been reviewed in over 12 months."),
+        count_rule(ALERT, ["last review date"], _invalid_dates, "{count} controls have no review date recorded."),
+        count_rule(ALERT, ["evidence"], _blank, "{count} controls are missing evidence."),
+        count_rule(ALERT, ["control owner"], _blank, "{count} controls are missing assigned owners."),
+        count_rule(ALERT, ["annex a reference"], _blank, "{count} controls are missing Annex A references."),
+        duplicate_rule(ALERT, ["control id"], "{count} controls have duplicate Control IDs."),
+    ],
+}
+
+
+@lru_cache(maxsize=256)
+def compile_rules(mode, columns):
+    """
+    Build the evaluation plan for a mode and a header: the rules whose required
+    columns are all present, each paired with its resolved column names.
+    Plans only depend on the header, so they are cached across datasets.
+    """
+    exact = {c: c for c in columns}
+    folded = {}
+    for c in columns:
+        folded.setdefault(str(c).strip().lower(), c)
+    plan = []
+    for rule in RULES.get(mode, []):
+        lookup = folded.get if rule.kind == ALERT else exact.get
+        resolved = [lookup(name) for name in rule.requires]
+        if all(c is not None for c in resolved):
+            plan.append((rule, tuple(resolved)))
+    return tuple(plan)
+
+
+def evaluate_rules(df: pd.DataFrame, mode="sox", now=None, views=None):
+    """
+    Run every anomaly and alert rule for `mode` against `df` in one pass over
+    shared normalized columns. Returns (anomalies, alerts) as message lists.
+    """
+    nf = NormalizedFrame(df, now, views)
+    plan = compile_rules(mode, tuple(df.columns))
+    return _collect(plan, [rule.partial(nf, *cols) for rule, cols in plan])
+
+
+def evaluate_rules_chunked(chunks, mode="sox", now=None):
+    """
+    Same as evaluate_rules, but folds an iterable of DataFrame chunks (e.g. from
+    read_csv(chunksize=...)) into per-rule aggregates, so memory is bounded by
+    the chunk size rather than the file size. The plan is compiled from the
+    first chunk's header; "now" and each date column's parsing decision (format
+    and fallback day/month order) are pinned for the whole run.
+    """
+    now = now if now is not None else pd.Timestamp.now()
+    date_formats = {}
+    plan, aggregates = None, None
+    for chunk in chunks:
+        if plan is None:
+            plan = compile_rules(mode, tuple(chunk.columns))
+        nf = NormalizedFrame(chunk, now, date_formats=date_formats)
+        partials = [rule.partial(nf, *cols) for rule, cols in plan]
+        if aggregates is None:
+            aggregates = partials
+        else:
+            aggregates = [rule.combine(a, p) for (rule, _), a, p in zip(plan, aggregates, partials)]
+    if plan is None:
+        return [], []
+    return _collect(plan, aggregates)
+
+
+def _collect(plan, aggregates):
+    results = {ANOMALY: [], ALERT: []}
+    for (rule, _), aggregate in zip(plan, aggregates):
+        message = rule.finish(aggregate)
+        if message:
+            results[rule.kind].append(message)
+    return results[ANOMALY], results[ALERT]
+
+
+# Columns each framework uses for its headline metrics (failed, overdue, missing owner)
+FRAMEWORK_COLUMNS = {
+    "sox": {"status": "Result", "fail_pattern": "fail", "date": "Due Date", "overdue_days": 0, "owner": "Owner"},
+    "esg": {"status": "Status", "fail_pattern": "fail", "date": "Due Date", "overdue_days": 0, "owner": "Owner"},
+    "soc2": {"status": "Status", "fail_pattern": "fail", "date": "Last Test Date", "overdue_days": 90, "owner": "Owner"},
+    "iso27001": {"status": "Status", "fail_pattern": "fail|not implemented", "date": "Last Review Date", "overdue_days": 365, "owner": "Control Owner"},
+}
+
+
+def framework_columns(mode):
+    return FRAMEWORK_COLUMNS.get(mode, FRAMEWORK_COLUMNS["iso27001"])
+
+
+def compliance_masks(nf: NormalizedFrame, mode="sox"):
+    """
+    Row masks behind the headline metrics, keyed by metric name. A mask is None
+    when the dataset lacks the column it is derived from.
+    """
+    spec = framework_columns(mode)
+    columns = set(nf.df.columns)
+
+    def when(col, build):
+        return build(col) if col in columns else None
+
+    return {
+        "failed": when(spec["status"], lambda c: nf.contains(c, spec["fail_pattern"])),
+        "overdue": when(spec["date"], lambda c: nf.older_than(c, spec["overdue_days"])),
+        "missing_owner": when(spec["owner"], nf.blank),
+        "missing_evidence": when("Evidence", nf.blank),
+        "missing_annex": when("Annex A Reference", nf.blank),
+    }
+
+
+def compliance_counts(nf: NormalizedFrame, mode="sox"):
+    counts = {name: int(mask.sum()) if mask is not None else 0 for name, mask in compliance_masks(nf, mode).items()}
+    counts["total"] = len(nf.df)
+    return counts
+
+
+def days_overdue(nf: NormalizedFrame, mode="sox", overdue=None):
+    """
+    Whole days each overdue row is past its framework's deadline, as floats with
+    NaN for rows that are not overdue. `overdue` is the mode's overdue mask when
+    the caller already has it.
+    """
+    spec = framework_columns(mode)
+    if overdue is None:
+        overdue = compliance_masks(nf, mode)["overdue"]
+    if overdue is None:
+        return pd.Series(np.nan, index=nf.df.index)
+    age = (nf.now - nf.dates(spec["date"])).dt.days
+    return (age - spec["overdue_days"]).clip(lower=0).where(overdue).astype(np.float64)
+
+
+def owner_performance(nf: NormalizedFrame, mode="sox"):
+    """
+    Per-owner totals, failure and overdue counts, failure rate and the median
+    and 90th percentile days overdue, from one groupby over precomputed flag
+    columns. Returns a DataFrame indexed by owner, or None when the dataset
+    lacks the owner or status column. Rows without an owner are left out.
+    """
+    spec = framework_columns(mode)
+    if spec["owner"] not in nf.df.columns or spec["status"] not in nf.df.columns:
+        return None
+    masks = compliance_masks(nf, mode)
+    overdue = masks["overdue"] if masks["overdue"] is not None else pd.Series(False, index=nf.df.index)
+    flags = pd.DataFrame({
+        "owner": nf.df[spec["owner"]],
+        "failed": masks["failed"].astype(np.int64),
+        "overdue": overdue.astype(np.int64),
+        "days_overdue": days_overdue(nf, mode, masks["overdue"]),
+    })
+    grouped = flags.groupby("owner", observed=True, sort=True)
+    stats = grouped.agg(
+        total=("failed", "size"),
+        failed=("failed", "sum"),
+        overdue=("overdue", "sum"),
+        median_days_overdue=("days_overdue", "median"),
+    )
+    stats["p90_days_overdue"] = grouped["days_overdue"].quantile(0.9)
+    stats["failure_rate"] = stats["failed"] / stats["total"]
+    return stats
+
+
+# Display columns for critical issues: candidate name columns (first present wins),
+# the ID column reported alongside, and the column shown as the issue's risk
+ISSUE_COLUMNS = {
+    "sox": {"name": ("Control Description", "Description"), "id": "Control ID", "risk": "Risk Rating"},
+    "esg": {"name": ("Metric", "Description"), "id": "Metric ID", "risk": "ESG Factor"},
+    "soc2": {"name": ("Control Description", "Description"), "id": "Control ID", "risk": "Trust Service Criteria"},
+    "iso27001": {"name": ("Control Name", "Control Description", "Description"), "id": "Control ID", "risk": "Status"},
+}
+
+RISK_LEVELS = (("high", 3), ("medium", 2), ("low", 1))
+
+
+def _display(df, col, positions, default):
+    if col is None or col not in df.columns:
+        return [default] * len(positions)
+    values = df[col].iloc[positions].astype(object)
+    return [default if pd.isna(v) else v for v in values]
+
+
+def critical_issues(nf: NormalizedFrame, mode="sox", limit=10):
+    """
+    The `limit` most severe issues, one per name. Candidates are failed or
+    overdue rows, plus high-risk rows in SOX. They are ranked by failure, then
+    "Risk Rating" level, then days overdue, with file order breaking ties; only
+    the selected rows are converted to dicts.
+    """
+    df = nf.df
+    n = len(df)
+    spec = framework_columns(mode)
+    masks = compliance_masks(nf, mode)
+    failed = masks["failed"].to_numpy(dtype=bool) if masks["failed"] is not None else np.zeros(n, dtype=bool)
+    overdue = masks["overdue"].to_numpy(dtype=bool) if masks["overdue"] is not None else np.zeros(n, dtype=bool)
+
+    risk = np.zeros(n, dtype=np.int8)
+    if "Risk Rating" in df.columns:
+        for pattern, level in RISK_LEVELS:
+            risk[(risk == 0) & nf.contains("Risk Rating", pattern).to_numpy(dtype=bool)] = level
+    high_risk = risk == 3 if mode == "sox" else np.zeros(n, dtype=bool)
+
+    days_late = days_overdue(nf, mode, masks["overdue"]).fillna(0).to_numpy(dtype=np.int64)
+
+    candidates = np.flatnonzero(failed | overdue | high_risk)
+    # lexsort is stable and sorts by its last key first
+    candidates = candidates[np.lexsort((-days_late[candidates], -risk[candidates], -failed[candidates].astype(np.int8)))]
+
+    columns = ISSUE_COLUMNS.get(mode, ISSUE_COLUMNS["iso27001"])
+    name_col = next((c for c in columns["name"] if c in df.columns), None)
+    if name_col is None:
+        # Every issue shares the placeholder name, so only the most severe is kept
+        selected = candidates[:min(limit, 1)]
+    else:
+        names = df[name_col].iloc[candidates].reset_index(drop=True)
+        selected = candidates[~names.duplicated().to_numpy()][:limit]
+
+    kinds = np.where(failed[selected], "Failed", np.where(high_risk[selected], "High Risk", "Overdue"))
+    rows = zip(
+        _display(df, columns["id"], selected, None),
+        _display(df, name_col, selected, "Unnamed Control"),
+        _display(df, columns["risk"], selected, "Unknown"),
+        _display(df, spec["owner"], selected, "Unknown"),
+        _display(df, spec["status"], selected, "Unknown"),
+    )
+    return [
+        {"id": id_, "name": str(name), "type": str(kind), "risk": risk_, "owner": owner, "status": status,
+         "days_overdue": int(days_late[pos])}
+        for (id_, name, risk_, owner, status), kind, pos in zip(rows, kinds, selected)
+    ]
@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class UploadIndex:
+    """
+    Versions of each uploaded filename in a SQLite file, newest last. Recording an
+    upload inserts or touches one row instead of rewriting the whole index.
+    Timestamps are epoch seconds.
+    """
+
+    def __init__(self, path: str, legacy_path: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            "id INTEGER PRIMARY KEY, filename TEXT NOT NULL, version TEXT NOT NULL, blob TEXT NOT NULL, "
+            "size INTEGER NOT NULL, uploaded_at REAL NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS versions_filename ON versions (filename, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS versions_last_seen ON versions (last_seen)")
+        self._conn.commit()
+        if legacy_path and os.path.exists(legacy_path):
+            self._import_json(legacy_path)
+            os.remove(legacy_path)
+
+    def _import_json(self, legacy_path: str):
+        """Load an index written by the JSON store: {filename: [version, ...]}, newest last."""
+        with open(legacy_path, 'r') as f:
+            index = json.load(f)
+        rows = [
+            (filename, v["version"], v["blob"], v["size"],
+             datetime.fromisoformat(v["uploaded_at"]).timestamp(), datetime.fromisoformat(v["last_seen"]).timestamp())
+            for filename, versions in index.items() for v in versions
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO versions (filename, version, blob, size, uploaded_at, last_seen) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def record(self, filename: str, blob: str, size: int, now: float = None) -> bool:
+        """
+        Note an upload of `blob` under `filename`. A repeat of the newest version
+        only refreshes its last_seen; returns whether a version was added.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            latest = self._conn.execute(
+                "SELECT id, blob FROM versions WHERE filename = ? ORDER BY id DESC LIMIT 1", (filename,)
+            ).fetchone()
+            if latest is not None and latest[1] == blob:
+                self._conn.execute("UPDATE versions SET last_seen = ? WHERE id = ?", (now, latest[0]))
+                self._conn.commit()
+                return False
+            self._conn.execute(
+                "INSERT INTO versions (filename, version, blob, size, uploaded_at, last_seen) VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, time.strftime("%Y%m%d%H%M%S", time.localtime(now)), blob, size, now, now),
+            )
+            self._conn.commit()
+            return True
+
+    def prune(self, cutoff: float, max_versions: int) -> int:
+        """Drop versions last seen before `cutoff` and all but the newest `max_versions` per filename."""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM versions WHERE last_seen < ?", (cutoff,)).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM versions WHERE id IN (SELECT id FROM ("
+                "SELECT id, ROW_NUMBER() OVER (PARTITION BY filename ORDER BY id DESC) AS n FROM versions) WHERE n > ?)",
+                (max_versions,),
+            ).rowcount
+            self._conn.commit()
+            return removed
+
+    def blobs(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT DISTINCT blob FROM versions")}
+
+    def versions(self, filename: str):
+        """A filename's versions, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, blob, size, uploaded_at, last_seen FROM versions WHERE filename = ? ORDER BY id", (filename,)
+            ).fetchall()
+        return [dict(zip(("version", "blob", "size", "uploaded_at", "last_seen"), row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -417,35 +417,27 @@ function UploadPage() {
     return '#E1F5FE';
   };
 
-  // Fetch analytics data when tab or file changes
+  // Fetch every analytics tab in one request when the file or mode changes
   useEffect(() => {
     if (!showAnalytics || !file) return;
     const fetchAnalytics = async () => {
       setAnalyticsLoading(true);
-      let endpoint = '';
-      switch (analyticsTab) {
-        case 'trends': endpoint = '/analytics/trends/'; break;
-        case 'owner': endpoint = '/analytics/owner-performance/'; break;
-        case 'benchmarks': endpoint = '/analytics/benchmarks/'; break;
-        case 'root': endpoint = '/analytics/root-cause/'; break;
-        case 'heatmap': endpoint = '/analytics/heatmap/'; break;
-        case 'cross': endpoint = '/analytics/cross-framework/'; break;
-        default: endpoint = '/analytics/trends/';
-      }
       const formData = new FormData();
       formData.append('file', file);
       formData.append('mode', mode);
-      const res = await fetch(`http://localhost:8000${endpoint}`, {
+      const token = localStorage.getItem('token');
+      const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
+      const res = await fetch('http://localhost:8000/analytics/bundle', {
         method: 'POST',
         body: formData,
-        headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` }
+        headers
       });
       const data = await res.json();
       setAnalyticsData(data);
       setAnalyticsLoading(false);
     };
     fetchAnalytics();
-  }, [showAnalytics, analyticsTab, file, mode]);
+  }, [showAnalytics, file, mode]);
 
   return (
     <div className="upload-container">
@@ -492,7 +484,7 @@ function UploadPage() {
                 <input 
                   id="file-input"
                   type="file" 
-                  accept=".csv,.xlsx,.xls" 
+                  accept=".csv,.xlsx,.xls,.parquet,.feather,.arrow" 
                   onChange={handleFileChange} 
                   className="file-input" 
                 />